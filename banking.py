@@ -0,0 +1,157 @@
+'''
+When to stop fighting and go bank the kills we are carrying.
+
+BankingPolicy compares the expected points per second of heading to the
+nearest goal now against fighting on for a while longer and banking
+afterwards, given kills carried, distance to the goal (read from a
+precomputed distance field), local threat and health. It is a handful of
+arithmetic operations, cheap enough for every decision tick.
+
+Decisions can be recorded as JSON lines; running this module replays a
+recording through a (re-tuned) policy and scores both the recorded and
+the replayed decisions by their expected points per second under a
+reference model (the default settings unless --reference says otherwise):
+
+    python banking.py recording.jsonl --set kill_rate=0.1 --set horizon=5
+'''
+
+import json
+import math
+from threading import Lock
+
+
+class BankingConfig(object):
+	'''
+	Tunables of the banking model
+	'''
+	def __init__(self, **overrides):
+		# units per second a tank covers on its way to a goal
+		self.tank_speed = 10.
+		# kills per second we expect while fighting
+		self.kill_rate = 0.2
+		# how long (seconds) "keep fighting" is assumed to last before banking anyway
+		self.horizon = 10.
+		# deaths per second at full health with no threat around
+		self.base_risk = 0.01
+		# extra deaths per second per unit of threat map danger
+		self.threat_weight = 0.05
+		# never bank with fewer kills than this
+		self.min_kills = 1
+		for name, value in overrides.items():
+			if not hasattr(self, name):
+				raise ValueError("Unknown banking setting {}".format(name))
+			setattr(self, name, type(getattr(self, name))(value))
+
+
+class GoalDistanceField(object):
+	'''
+	Distance to the nearest goal on a grid over the arena
+	'''
+	MIN_X, MAX_X = -70., 70.
+	MIN_Y, MAX_Y = -100., 100.
+
+	def __init__(self, goals=((0, 100), (0, -100)), cell_size=2.):
+		self.cell_size = cell_size
+		self.cols = int(math.ceil((self.MAX_X - self.MIN_X) / cell_size)) + 1
+		self.rows = int(math.ceil((self.MAX_Y - self.MIN_Y) / cell_size)) + 1
+		self.distances = []
+		for row in range(self.rows):
+			y = self.MIN_Y + row * cell_size
+			for col in range(self.cols):
+				x = self.MIN_X + col * cell_size
+				self.distances.append(min(math.hypot(x - gx, y - gy) for gx, gy in goals))
+
+	def __call__(self, x, y):
+		col = int(round((x - self.MIN_X) / self.cell_size))
+		row = int(round((y - self.MIN_Y) / self.cell_size))
+		col = min(max(col, 0), self.cols - 1)
+		row = min(max(row, 0), self.rows - 1)
+		return self.distances[row * self.cols + col]
+
+
+class BankingPolicy(object):
+	def __init__(self, config=None, record_path=None):
+		self.config = config or BankingConfig()
+		self.goal_distance = GoalDistanceField()
+		self.record_file = open(record_path, 'a') if record_path else None
+		self.record_lock = Lock()
+
+	def rates(self, kills, distance, danger, health):
+		'''
+		Expected points per second of (banking now, fighting on then banking)
+		'''
+		c = self.config
+		trip = distance / c.tank_speed
+		risk = (c.base_risk + c.threat_weight * danger) / max(health, 1)
+		survive_trip = math.exp(-risk * trip)
+		bank_now = kills * survive_trip / max(trip, 1e-3)
+		survive_fight = math.exp(-risk * c.horizon)
+		fight = (kills + c.kill_rate * c.horizon) * survive_fight * survive_trip / (c.horizon + trip)
+		return bank_now, fight
+
+	def shouldBank(self, kills, x, y, health, danger=0., tank=None):
+		if kills < self.config.min_kills:
+			bank = False
+		else:
+			bank_now, fight = self.rates(kills, self.goal_distance(x, y), danger, health)
+			bank = bank_now >= fight
+		if self.record_file:
+			self.record(tank, kills, x, y, health, danger, bank)
+		return bank
+
+	def record(self, tank, kills, x, y, health, danger, bank):
+		line = json.dumps({'tank': tank, 'kills': kills, 'x': x, 'y': y,
+			'health': health, 'danger': danger, 'bank': bank})
+		with self.record_lock:
+			self.record_file.write(line + '\n')
+
+	def close(self):
+		if self.record_file:
+			self.record_file.close()
+			self.record_file = None
+
+
+def evaluate(path, policy, reference=None):
+	'''
+	Replay recorded decisions through policy; returns summary counts and
+	the mean expected points per second of the recorded and of the
+	policy's decisions, both from reference.rates() (default settings if
+	no reference is given)
+	'''
+	reference = reference or BankingPolicy()
+	summary = {'ticks': 0, 'recorded_bank': 0, 'policy_bank': 0, 'changed': 0,
+		'recorded_rate': 0., 'policy_rate': 0.}
+	with open(path) as f:
+		for line in f:
+			if not line.strip():
+				continue
+			r = json.loads(line)
+			bank = policy.shouldBank(r['kills'], r['x'], r['y'], r['health'], r['danger'])
+			bank_now, fight = reference.rates(r['kills'], reference.goal_distance(r['x'], r['y']), r['danger'], r['health'])
+			summary['ticks'] += 1
+			summary['recorded_bank'] += r['bank']
+			summary['policy_bank'] += bank
+			summary['changed'] += bank != r['bank']
+			summary['recorded_rate'] += bank_now if r['bank'] else fight
+			summary['policy_rate'] += bank_now if bank else fight
+	if summary['ticks']:
+		summary['recorded_rate'] /= summary['ticks']
+		summary['policy_rate'] /= summary['ticks']
+	return summary
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Replay recorded banking decisions')
+	parser.add_argument('recording', help='JSON lines written with --record-banking')
+	parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='Override a BankingConfig setting')
+	parser.add_argument('--reference', action='append', default=[], metavar='NAME=VALUE',
+		help='Override a setting of the model both policies are scored with')
+	args = parser.parse_args()
+
+	overrides = dict(item.split('=', 1) for item in args.set)
+	reference = dict(item.split('=', 1) for item in args.reference)
+	summary = evaluate(args.recording, BankingPolicy(BankingConfig(**overrides)), BankingPolicy(BankingConfig(**reference)))
+	print("{ticks} ticks: recorded policy banked on {recorded_bank}, this one on {policy_bank} "
+		"({changed} decisions differ)".format(**summary))
+	print("expected points per second: recorded {recorded_rate:.4f}, this one {policy_rate:.4f}".format(**summary))
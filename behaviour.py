@@ -0,0 +1,84 @@
+'''
+Prioritised state machines for tank behaviours.
+
+A StateMachine holds one Behaviour per state. Every tick it first checks
+its transition rules, highest priority first, and takes the first whose
+guard holds. It then runs the current behaviour's tick once, so exactly
+one behaviour acts per tick. A transition requested from inside a tick
+is held and taken at the start of the next one, so the behaviour (and
+its budget) stays the same for a whole tick. Entry and exit actions run
+on every transition, never on reset().
+
+A machine belongs to one thread: others should ask that thread to
+transition rather than call transition() themselves.
+'''
+
+
+class Behaviour(object):
+	__slots__ = ('tick', 'enter', 'exit', 'budget')
+
+	def __init__(self, tick, enter=None, exit=None, budget=None):
+		self.tick = tick
+		self.enter = enter
+		self.exit = exit
+		# message type -> commands of that type this behaviour may send per tick
+		self.budget = budget or {}
+
+
+class StateMachine(object):
+	def __init__(self, name, behaviours, initial):
+		self.name = name
+		self.behaviours = behaviours
+		self.initial = initial
+		self.state = initial
+		self.rules = []
+		# requested during a tick, taken at the start of the next
+		self.pending = None
+		self.ticking = False
+
+	def addRule(self, priority, state, guard):
+		'''
+		Move to state whenever guard() holds at the start of a tick, unless
+		a higher priority rule applies
+		'''
+		self.rules.append((priority, state, guard))
+		self.rules.sort(key=lambda rule: -rule[0])
+
+	def transition(self, state):
+		if self.ticking:
+			self.pending = state
+			return
+		if state == self.state:
+			return
+		old = self.behaviours.get(self.state)
+		if old and old.exit:
+			old.exit()
+		self.state = state
+		new = self.behaviours.get(state)
+		if new and new.enter:
+			new.enter()
+
+	def reset(self):
+		self.state = self.initial
+		self.pending = None
+
+	@property
+	def current(self):
+		return self.behaviours.get(self.state)
+
+	def tick(self):
+		if self.pending is not None:
+			state, self.pending = self.pending, None
+			self.transition(state)
+		for _, state, guard in self.rules:
+			if state != self.state and guard():
+				self.transition(state)
+				break
+		behaviour = self.behaviours.get(self.state)
+		if behaviour:
+			self.ticking = True
+			try:
+				behaviour.tick()
+			finally:
+				self.ticking = False
+		return behaviour
@@ -0,0 +1,72 @@
+'''
+The server's game clock, seen from our local clock.
+
+GAMETIMEUPDATE carries the game time in whole seconds, counting up or
+down depending on the server. Each one gives an offset between the local
+time it was received and the game time; the smallest offset over a recent
+window is the one with the least delay on the way to us, so it is taken
+as the true offset and the rest is jitter. How far a connection's
+samples sit above that minimum is how late its messages are currently
+being received, e.g. because they queued in the socket while we were
+busy, and observations arriving on it are back-dated by that much. With
+only one sample a second per connection, that lag is smoothed and capped
+so that a single late GAMETIMEUPDATE cannot shift a second's worth of
+timestamps.
+'''
+
+from collections import deque
+from threading import Lock
+
+
+class ClockSync(object):
+	# samples the minimum is taken over
+	WINDOW = 30
+	# a jump back in game time by more than this (seconds) means a new game
+	RESTART = 2.
+	# smoothing gain of a connection's lag, and the most (seconds) it is trusted to be
+	LAG_GAIN = 0.25
+	MAX_LAG = 0.2
+
+	def __init__(self):
+		# (elapsed game time, local - elapsed)
+		self.samples = deque(maxlen=ClockSync.WINDOW)
+		# +1 if game time counts up, -1 if down, None until seen to change
+		self.direction = None
+		self.first = None
+		self.offset = None
+		# connection index -> seconds its messages currently arrive late by
+		self.lag = {}
+		self.lock = Lock()
+
+	def observe(self, game_time, received, index=None):
+		with self.lock:
+			if self.direction is None:
+				if self.first is None or self.first == game_time:
+					self.first = game_time
+					return
+				self.direction = 1 if game_time > self.first else -1
+			elapsed = self.direction * game_time
+			if self.samples and elapsed < self.samples[-1][0] - ClockSync.RESTART:
+				self.samples.clear()
+				self.lag = {}
+			offset = received - elapsed
+			self.samples.append((elapsed, offset))
+			self.offset = min(o for _, o in self.samples)
+			lag = self.lag.get(index, 0.)
+			lag += ClockSync.LAG_GAIN * (offset - self.offset - lag)
+			self.lag[index] = min(lag, ClockSync.MAX_LAG)
+
+	def observedAt(self, received, index=None):
+		'''
+		Local time a message received at received on connection index was
+		sent by the server, as best we can tell
+		'''
+		return received - self.lag.get(index, 0.)
+
+	def gameTime(self, local):
+		'''
+		The server's game clock at local time local, None until synchronised
+		'''
+		if self.offset is None:
+			return None
+		return self.direction * (local - self.offset)
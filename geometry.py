@@ -0,0 +1,194 @@
+'''
+Batched versions of the helpers in tools.py.
+
+Every function takes one origin (or several, for distance_matrix) and a
+sequence of targets, and uses NumPy when it is installed and the batch is
+big enough for it to pay off. Otherwise it falls back to plain Python. Headings
+follow tools.rotate_head: degrees in [0, 360) measured like atan2.
+
+Run this module directly for a benchmark against the scalar helpers.
+'''
+
+import math
+from threading import Lock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# below this many targets converting to arrays costs more than it saves
+NUMPY_THRESHOLD = 32
+
+
+def use_numpy(n):
+    return np is not None and n >= NUMPY_THRESHOLD
+
+
+def normalise_angles(angles):
+    if use_numpy(len(angles)):
+        return np.mod(angles, 360.)
+    return [a % 360 for a in angles]
+
+
+def angle_diffs(a, angles):
+    '''
+    Absolute angular difference in degrees, in [0, 180], between a and each angle
+    '''
+    if use_numpy(len(angles)):
+        d = np.mod(np.asarray(angles, dtype=float) - a, 360.)
+        return np.minimum(d, 360. - d)
+    diffs = []
+    for b in angles:
+        d = (b - a) % 360
+        diffs.append(min(d, 360 - d))
+    return diffs
+
+
+def distances(x, y, xs, ys):
+    if use_numpy(len(xs)):
+        return np.hypot(np.asarray(xs, dtype=float) - x, np.asarray(ys, dtype=float) - y)
+    hypot = math.hypot
+    return [hypot(tx - x, ty - y) for tx, ty in zip(xs, ys)]
+
+
+def bearings(x, y, xs, ys):
+    if use_numpy(len(xs)):
+        rad = np.arctan2(np.asarray(ys, dtype=float) - y, np.asarray(xs, dtype=float) - x)
+        return np.mod(np.degrees(rad), 360.)
+    atan2 = math.atan2
+    k = 180 / math.pi
+    return [(atan2(ty - y, tx - x) * k) % 360 for tx, ty in zip(xs, ys)]
+
+
+def distance_matrix(oxs, oys, xs, ys):
+    '''
+    Distances from every origin (rows) to every target (columns)
+    '''
+    if np is not None and len(oxs) * len(xs) >= NUMPY_THRESHOLD:
+        ox = np.asarray(oxs, dtype=float)[:, None]
+        oy = np.asarray(oys, dtype=float)[:, None]
+        return np.hypot(np.asarray(xs, dtype=float)[None, :] - ox, np.asarray(ys, dtype=float)[None, :] - oy)
+    return [distances(x, y, xs, ys) for x, y in zip(oxs, oys)]
+
+
+def nearest(x, y, objects):
+    '''
+    Closest of a collection of objects with .x/.y attributes, as (object, distance).
+    Returns (None, inf) if there are none.
+    '''
+    objects = list(objects)
+    if not objects:
+        return None, float('inf')
+    if use_numpy(len(objects)):
+        dists = distances(x, y, [o.x for o in objects], [o.y for o in objects])
+        i = int(np.argmin(dists))
+        return objects[i], float(dists[i])
+    hypot = math.hypot
+    best, best_dist = None, float('inf')
+    for o in objects:
+        d = hypot(o.x - x, o.y - y)
+        if d < best_dist:
+            best, best_dist = o, d
+    return best, best_dist
+
+
+def segment_hits_circle(x0, y0, x1, y1, cx, cy, r):
+    '''
+    Whether the segment (x0, y0)-(x1, y1) passes within r of (cx, cy)
+    '''
+    dx, dy = x1 - x0, y1 - y0
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return math.hypot(cx - x0, cy - y0) <= r
+    t = ((cx - x0) * dx + (cy - y0) * dy) / length2
+    t = max(0., min(1., t))
+    return math.hypot(x0 + t * dx - cx, y0 + t * dy - cy) <= r
+
+
+class SpatialGrid(object):
+    '''
+    Uniform grid of keyed points.
+
+    Cells hold frozensets that are replaced, never modified, so queries
+    from other threads need no lock; writers are serialised by a lock.
+    '''
+
+    def __init__(self, cell_size=20.):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        self.positions = {}
+        self.write_lock = Lock()
+
+    def cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def move(self, key, x, y):
+        with self.write_lock:
+            new_cell = self.cell(x, y)
+            old = self.positions.get(key)
+            self.positions[key] = (x, y)
+            if old is not None:
+                old_cell = self.cell(*old)
+                if old_cell == new_cell:
+                    return
+                self.cells[old_cell] = self.cells[old_cell] - {key}
+            self.cells[new_cell] = self.cells.get(new_cell, frozenset()) | {key}
+
+    def remove(self, key):
+        with self.write_lock:
+            old = self.positions.pop(key, None)
+            if old is not None:
+                old_cell = self.cell(*old)
+                self.cells[old_cell] = self.cells[old_cell] - {key}
+
+    def query_rect(self, min_x, min_y, max_x, max_y):
+        '''
+        Keys in every cell overlapping the rectangle (a superset of the points inside it)
+        '''
+        cx0, cy0 = self.cell(min_x, min_y)
+        cx1, cy1 = self.cell(max_x, max_y)
+        cells = self.cells
+        found = set()
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                keys = cells.get((cx, cy))
+                if keys:
+                    found |= keys
+        return found
+
+    def query_segment(self, x0, y0, x1, y1, pad=0.):
+        '''
+        Candidate keys that may lie within pad of the segment
+        '''
+        return self.query_rect(min(x0, x1) - pad, min(y0, y1) - pad, max(x0, x1) + pad, max(y0, y1) + pad)
+
+
+if __name__ == '__main__':
+    import random
+    import timeit
+    from tools import distance, rotate_head
+
+    class Point(object):
+        __slots__ = ('x', 'y')
+
+        def __init__(self, x, y):
+            self.x = x
+            self.y = y
+
+    print("numpy: {}".format(np is not None))
+    for n in (4, 16, 64, 256):
+        points = [Point(random.uniform(-100, 100), random.uniform(-100, 100)) for _ in range(n)]
+        xs = [p.x for p in points]
+        ys = [p.y for p in points]
+        runs = 20000 // n + 100
+
+        scalar = timeit.timeit(lambda: min(points, key=lambda p: distance(0., 0., p.x, p.y)), number=runs)
+        batched = timeit.timeit(lambda: nearest(0., 0., points), number=runs)
+        print("nearest   n={:4d}  scalar {:8.2f}us  batched {:8.2f}us".format(
+            n, scalar / runs * 1e6, batched / runs * 1e6))
+
+        scalar = timeit.timeit(lambda: [rotate_head(0., 0., x, y) for x, y in zip(xs, ys)], number=runs)
+        batched = timeit.timeit(lambda: bearings(0., 0., xs, ys), number=runs)
+        print("bearings  n={:4d}  scalar {:8.2f}us  batched {:8.2f}us".format(
+            n, scalar / runs * 1e6, batched / runs * 1e6))
@@ -0,0 +1,87 @@
+'''
+Handoff between a tank's socket reader thread and its decision thread.
+
+Object updates go into a bounded deque that silently loses its oldest
+entry when full, so a slow decision thread only ever skips stale
+positions. Events go into an unbounded deque and are never dropped.
+Every message carries a sequence number so that drain() can interleave
+the two queues back into arrival order. deque appends and pops are
+atomic, so neither side takes a lock on the data path.
+'''
+
+import logging
+from collections import deque
+from threading import Event, Thread
+
+
+class Inbox(object):
+	def __init__(self, is_update, capacity=256):
+		self.is_update = is_update
+		self.updates = deque(maxlen=capacity)
+		self.events = deque()
+		self.seq = 0
+		self.dropped = 0
+		self.ready = Event()
+
+	def put(self, message):
+		'''
+		Called from the reader thread only
+		'''
+		self.seq += 1
+		if self.is_update(message):
+			if len(self.updates) == self.updates.maxlen:
+				self.dropped += 1
+			self.updates.append((self.seq, message))
+		else:
+			self.events.append((self.seq, message))
+		self.ready.set()
+
+	def wait(self, timeout):
+		if self.ready.wait(timeout):
+			self.ready.clear()
+
+	def drain(self):
+		'''
+		Everything queued so far, in arrival order. Called from the consumer only.
+		'''
+		messages = []
+		events, updates = self.events, self.updates
+		pending = None
+		while True:
+			if pending is None and updates:
+				try:
+					# popped rather than peeked: the reader may push it out at any time
+					pending = updates.popleft()
+				except IndexError:
+					pass
+			if events and (pending is None or events[0][0] < pending[0]):
+				messages.append(events.popleft()[1])
+			elif pending is not None:
+				messages.append(pending[1])
+				pending = None
+			else:
+				return messages
+
+
+class Reader(Thread):
+	'''
+	Reads messages with read() forever and hands them to an Inbox
+	'''
+	def __init__(self, name, read, inbox):
+		Thread.__init__(self, name=name)
+		self.daemon = True
+		self.read = read
+		self.inbox = inbox
+		self.is_running = True
+
+	def run(self):
+		while self.is_running:
+			try:
+				message = self.read()
+			except Exception as e:
+				logging.info("{} stopped reading: {}".format(self.name, e))
+				return
+			self.inbox.put(message)
+
+	def kill(self):
+		self.is_running = False
@@ -0,0 +1,106 @@
+'''
+How long the server takes to act on our commands.
+
+A LatencyEstimator is told when a command setting an absolute value (a
+heading, a turret heading) leaves for the server, and then sees every
+value of that kind reported for our tank. The first report that has moved
+towards the commanded value, compared with the value when the command was
+sent, closes the round trip. Samples are smoothed the way TCP smooths
+round-trip times: a running mean plus a running mean deviation.
+
+Samples can be recorded as JSON lines to chart latency over a match.
+'''
+
+import json
+from threading import Lock
+
+from tools import angle_diff
+
+
+class SampleLog(object):
+	'''
+	JSON lines file shared by several writers
+	'''
+	def __init__(self, path):
+		self.file = open(path, 'a')
+		self.lock = Lock()
+
+	def write(self, **fields):
+		line = json.dumps(fields)
+		with self.lock:
+			if self.file:
+				self.file.write(line + '\n')
+
+	def close(self):
+		with self.lock:
+			if self.file:
+				self.file.close()
+				self.file = None
+
+
+class LatencyEstimator(object):
+	# degrees a value must have closed on its target to count as a response
+	PROGRESS = 1.
+	# commands still unanswered after this many seconds are given up on
+	TIMEOUT = 2.
+	# smoothing gains of the mean and of the mean deviation
+	GAIN = 0.125
+	DEVIATION_GAIN = 0.25
+
+	def __init__(self, name=None, log=None):
+		self.name = name
+		self.log = log
+		# seconds; None until the first sample
+		self.estimate = None
+		self.deviation = 0.
+		self.samples = 0
+		# kind -> (target, time sent, value when sent)
+		self.pending = {}
+		# kind -> last value reported
+		self.last = {}
+		# commands are timed on the owner's thread, reports arrive on whichever
+		# bot's thread received them
+		self.lock = Lock()
+
+	def forget(self):
+		'''
+		Drop what refers to the current tank, e.g. when it respawns
+		'''
+		with self.lock:
+			self.pending = {}
+			self.last = {}
+
+	def commandSent(self, kind, target, now):
+		with self.lock:
+			start = self.last.get(kind)
+			if start is None or angle_diff(start, target) <= LatencyEstimator.PROGRESS:
+				# nothing to turn, so no response to time
+				self.pending.pop(kind, None)
+				return
+			self.pending[kind] = (target, now, start)
+
+	def observed(self, kind, value, now):
+		with self.lock:
+			self.last[kind] = value
+			pending = self.pending.get(kind)
+			if pending is None:
+				return
+			target, sent, start = pending
+			if now - sent > LatencyEstimator.TIMEOUT:
+				del self.pending[kind]
+			elif angle_diff(value, target) <= angle_diff(start, target) - LatencyEstimator.PROGRESS:
+				del self.pending[kind]
+				self.addSample(kind, now - sent, now)
+
+	def addSample(self, kind, sample, now):
+		# reports are back-dated by the clock sync, which may overshoot
+		sample = max(sample, 0.)
+		self.samples += 1
+		if self.estimate is None:
+			self.estimate = sample
+			self.deviation = sample / 2.
+		else:
+			self.deviation += LatencyEstimator.DEVIATION_GAIN * (abs(sample - self.estimate) - self.deviation)
+			self.estimate += LatencyEstimator.GAIN * (sample - self.estimate)
+		if self.log:
+			self.log.write(tank=self.name, kind=kind, time=now, latency=sample, estimate=self.estimate)
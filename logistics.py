@@ -0,0 +1,80 @@
+'''
+Team-wide resupply planning.
+
+Tanks that are out of ammo or low on health get a pickup reserved for
+them, so no two tanks race for the same one. The plan is only redone when
+a pickup appears or disappears or a tank's needs change; between those
+events a tank's assignment is a dict lookup.
+'''
+
+import math
+from threading import Lock
+
+
+class LogisticsPlanner(object):
+	AMMO = 'ammo'
+	HEALTH = 'health'
+	# tanks at or below this health go for health pickups
+	LOW_HEALTH = 1
+
+	def __init__(self):
+		self.pickups = {}
+		self.tanks = {}
+		self.needs = {}
+		# tank_no -> Pickup, replaced as a whole on every plan
+		self.assignments = {}
+		self.lock = Lock()
+
+	def urgency(self, kind, ammo, health):
+		'''
+		How badly a tank wants a pickup of this kind, 0 if not at all
+		'''
+		if kind == LogisticsPlanner.AMMO:
+			return 2. if ammo == 0 else 0.
+		if health <= 0 or health > LogisticsPlanner.LOW_HEALTH:
+			return 0.
+		return 3.
+
+	def pickupAppeared(self, pickup, kind):
+		with self.lock:
+			known = pickup.id in self.pickups
+			self.pickups[pickup.id] = (kind, pickup)
+			if not known:
+				self.plan()
+
+	def pickupGone(self, pickup_id):
+		with self.lock:
+			if self.pickups.pop(pickup_id, None) is not None:
+				self.plan()
+
+	def tankChanged(self, tank_no, x, y, ammo, health):
+		with self.lock:
+			self.tanks[tank_no] = (x, y, ammo, health)
+			needs = tuple(self.urgency(kind, ammo, health) > 0 for kind in (LogisticsPlanner.AMMO, LogisticsPlanner.HEALTH))
+			if self.needs.get(tank_no) != needs:
+				self.needs[tank_no] = needs
+				self.plan()
+
+	def plan(self):
+		'''
+		Greedy assignment by travel distance over urgency; called with the lock held
+		'''
+		options = []
+		for tank_no, (x, y, ammo, health) in self.tanks.items():
+			for pickup_id, (kind, pickup) in self.pickups.items():
+				urgency = self.urgency(kind, ammo, health)
+				if urgency > 0:
+					options.append((math.hypot(pickup.x - x, pickup.y - y) / urgency, tank_no, pickup_id))
+		options.sort()
+
+		assignments = {}
+		taken = set()
+		for _, tank_no, pickup_id in options:
+			if tank_no in assignments or pickup_id in taken:
+				continue
+			assignments[tank_no] = self.pickups[pickup_id][1]
+			taken.add(pickup_id)
+		self.assignments = assignments
+
+	def assignment(self, tank_no):
+		return self.assignments.get(tank_no)
@@ -166,6 +166,9 @@ class ServerComms(object):
 
 
 class Bot(Thread):
+	# the turret toggle does not survive a respawn, so it is repeated this often (seconds)
+	RESEND_INTERVAL = 1.
+
 	def __init__(self, hostname, port, team_name, index):
 		Thread.__init__(self)
 		self.name = "{}:{}".format(team_name, index)
@@ -184,7 +187,7 @@ class Bot(Thread):
 		self.Y = 0.
 		self.last_X = 0.
 		self.last_Y = 0.
-		self.last_turret_update = time.time()
+		self.last_turret_update = 0.
 
 
 	def run(self):
@@ -210,11 +213,11 @@ class Bot(Thread):
 			message = self.readMessage()
 			field.update(message)
 
-			turret = 0
-			self.sendMessage(ServerMessageTypes.TOGGLETURRETRIGHT, {'Amount': turret})
-			turret = (turret + 60) % 360
-
-			self.last_turret_update = time.time()
+			# the turret keeps turning until told otherwise or the tank respawns
+			now = time.time()
+			if now - self.last_turret_update > Bot.RESEND_INTERVAL:
+				self.sendMessage(ServerMessageTypes.TOGGLETURRETRIGHT, {'Amount': 0})
+				self.last_turret_update = now
 			if self.start_rotating:
 				new_degree = rotate_head(self.X, self.Y, 0., 0.)
 				
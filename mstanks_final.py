@@ -6,12 +6,37 @@ import logging
 import binascii
 import struct
 import argparse
-from threading import Thread
+import select
+from threading import Thread, Lock
 import atexit
+import multiprocessing
 import math
 import time
 import random
-from tools import rotate_head, distance, deg2rad
+from collections import deque
+try:
+	import fcntl
+	import termios
+except ImportError:
+	# Windows: only what we still hold ourselves counts towards the backlog there
+	fcntl = None
+import tools
+from tools import rotate_head, distance, angle_diff
+from geometry import nearest, segment_hits_circle, SpatialGrid
+from threat import ThreatMap
+from snitch import SnitchTracker
+from logistics import LogisticsPlanner
+from banking import BankingPolicy
+from behaviour import Behaviour, StateMachine
+from inbox import Inbox, Reader
+from ratelimit import CommandLimiter, parseLimits
+from latency import LatencyEstimator, SampleLog
+from clock import ClockSync
+from reckoning import PoseEstimator
+import tracking
+from tracking import EnemyTracker
+from shared_world import SharedWorld
+from world import Point, EnemyState, Pickup, Snitch, TankState, WorldView
 
 
 class ServerMessageTypes(object):
@@ -84,6 +109,23 @@ class ServerMessageTypes(object):
 			return "??UNKNOWN??"
 
 
+def conflate(messages):
+	'''
+	Drop every OBJECTUPDATE that a later one for the same Id supersedes,
+	keeping everything else (and the order) as it was
+	'''
+	seen = set()
+	kept = []
+	for message in reversed(messages):
+		if message['messageType'] == ServerMessageTypes.OBJECTUPDATE:
+			if message['Id'] in seen:
+				continue
+			seen.add(message['Id'])
+		kept.append(message)
+	kept.reverse()
+	return kept
+
+
 class ServerComms(object):
 	'''
 	TCP comms handler
@@ -97,38 +139,66 @@ class ServerComms(object):
 	ServerSocket = None
 	MessageTypes = ServerMessageTypes()
 
-	def __init__(self, hostname, port):
+	# outbound priority classes, flushed in this order
+	COMBAT, TURRET, MOVEMENT = range(3)
+	PRIORITIES = {
+		ServerMessageTypes.FIRE: COMBAT,
+		ServerMessageTypes.TOGGLETURRETLEFT: TURRET,
+		ServerMessageTypes.TOGGLETURRETRIGHT: TURRET,
+		ServerMessageTypes.TURNTURRETTOHEADING: TURRET,
+		ServerMessageTypes.STOPTURRET: TURRET,
+	}
+	# seconds a queued command of each class stays worth sending; None never goes stale.
+	# A FIRE was only checked against the aim and teammates of the tick that sent it
+	STALE_AFTER = {COMBAT: 0.1, TURRET: None, MOVEMENT: 0.25}
+	# per-call non-blocking send, where the platform has it
+	DONTWAIT = getattr(socket, 'MSG_DONTWAIT', None)
+
+	def __init__(self, hostname, port, limiter=None):
 		self.ServerSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.ServerSocket.connect((hostname, port))
-
-	def readTolength(self, length):
-		messageData = self.ServerSocket.recv(length)
-		while len(messageData) < length:
-			buffData = self.ServerSocket.recv(length - len(messageData))
-			if buffData:
-				messageData += buffData
-		return messageData
-
-	def readMessage(self):
+		# bytes received but not parsed yet, always starting at a message boundary
+		self.buffer = bytearray()
+		# local time of the last recv(), which completed every frame parsed since
+		self.received = time.time()
+		# commands waiting to be sent: per priority class, a deque of (deadline, messageType, frame, payload)
+		self.outbound = [deque() for _ in self.STALE_AFTER]
+		# the unsent tail of a frame that has partly gone out already; nothing may overtake it
+		self.partial = b''
+		# caps queued commands' send rate and keeps counts of what happened to them
+		self.limiter = limiter or CommandLimiter()
+		# called with (messageType, payload, time) for every queued command as it goes out
+		self.on_sent = None
+
+	def hasFrame(self):
+		buf = self.buffer
+		return len(buf) >= 2 and len(buf) >= 2 + buf[1]
+
+	def parseFrames(self, limit=None):
 		'''
-		Read a message from the server
+		Parse up to limit complete messages off the front of the buffer
 		'''
-
-		#logging.debug("Before message type")
-		messageTypeRaw = self.ServerSocket.recv(1)
-		#logging.debug("Before message length")
-		messageLenRaw = self.ServerSocket.recv(1)
-		messageType = struct.unpack('>B', messageTypeRaw)[0]
-		messageLen = struct.unpack('>B', messageLenRaw)[0]
-
-		if messageLen == 0:
-			messageData = bytearray()
+		buf = self.buffer
+		end = len(buf)
+		pos = 0
+		messages = []
+		while end - pos >= 2 and end - pos >= 2 + buf[pos + 1] and (limit is None or len(messages) < limit):
+			messageType = buf[pos]
+			messageLen = buf[pos + 1]
+			messageData = bytes(buf[pos + 2:pos + 2 + messageLen])
+			pos += 2 + messageLen
+			messages.append(self.decode(messageType, messageData))
+		del buf[:pos]
+		return messages
+
+	def decode(self, messageType, messageData):
+		if not messageData:
 			messagePayload = {'messageType': messageType}
 		else:
-			messageData = self.readTolength(messageLen)
 			logging.debug("*** {}".format(messageData))
 			messagePayload = json.loads(messageData.decode('utf-8'))
 			messagePayload['messageType'] = messageType
+		messagePayload['received'] = self.received
 
 		logging.debug('Turned message {} into type {} payload {}'.format(
 			binascii.hexlify(messageData),
@@ -136,34 +206,190 @@ class ServerComms(object):
 			messagePayload))
 		return messagePayload
 
-	def sendMessage(self, messageType=None, messagePayload=None):
-			'''
-			Send a message to the server
-			'''
-			message = bytearray()
+	def readMessage(self):
+		'''
+		Read a message from the server
+		'''
+		while not self.hasFrame():
+			data = self.ServerSocket.recv(4096)
+			if not data:
+				raise socket.error("Connection closed by server")
+			self.buffer += data
+			self.received = time.time()
+		return self.parseFrames(1)[0]
+
+	def readAvailable(self):
+		'''
+		Every complete message already received, without blocking
+		'''
+		closed = False
+		self.ServerSocket.setblocking(False)
+		try:
+			while True:
+				data = self.ServerSocket.recv(65536)
+				if not data:
+					closed = True
+					break
+				self.buffer += data
+				self.received = time.time()
+		except BlockingIOError:
+			pass
+		finally:
+			self.ServerSocket.setblocking(True)
+		messages = self.parseFrames()
+		# what arrived before the end still counts; the next call raises
+		if closed and not messages:
+			raise socket.error("Connection closed by server")
+		return messages
+
+	def hasMessage(self, timeout=0.):
+		'''
+		True if a message is waiting, waiting at most timeout seconds for the socket
+		'''
+		if self.hasFrame():
+			return True
+		readable, _, _ = select.select([self.ServerSocket], [], [], timeout)
+		return bool(readable)
 
-			if messageType is not None:
-				message.append(messageType)
-			else:
-				message.append(0)
+	def encode(self, messageType=None, messagePayload=None):
+		message = bytearray()
+
+		if messageType is not None:
+			message.append(messageType)
+		else:
+			message.append(0)
+
+		if messagePayload is not None:
+			messageString = json.dumps(messagePayload)
+			message.append(len(messageString))
+			message.extend(str.encode(messageString))
+
+		else:
+			message.append(0)
 
-			if messagePayload is not None:
-				messageString = json.dumps(messagePayload)
-				message.append(len(messageString))
-				message.extend(str.encode(messageString))
+		logging.debug('Turned message type {} payload {} into {}'.format(
+			self.MessageTypes.toString(messageType),
+			messagePayload,
+			binascii.hexlify(message)))
+		return bytes(message)
 
+	def sendMessage(self, messageType=None, messagePayload=None):
+		'''
+		Send a message to the server straight away, blocking if need be
+		'''
+		if self.partial:
+			self.ServerSocket.sendall(self.partial)
+			self.partial = b''
+		return self.ServerSocket.sendall(self.encode(messageType, messagePayload))
+
+	def queue(self, messageType, messagePayload=None):
+		'''
+		Queue a command for the next flush() according to its priority class.
+		It replaces a command of the same type still waiting in the queue,
+		except for FIRE where every one counts.
+		'''
+		priority = self.PRIORITIES.get(messageType, ServerComms.MOVEMENT)
+		stale_after = self.STALE_AFTER[priority]
+		deadline = None if stale_after is None else time.time() + stale_after
+		entry = (deadline, messageType, self.encode(messageType, messagePayload), messagePayload)
+		queue = self.outbound[priority]
+		if messageType != ServerMessageTypes.FIRE:
+			for i, (_, queuedType, _, _) in enumerate(queue):
+				if queuedType == messageType:
+					queue[i] = entry
+					self.limiter.merged[messageType] += 1
+					return
+		queue.append(entry)
+
+	def hasOutbound(self):
+		return bool(self.partial) or any(self.outbound)
+
+	def flush(self):
+		'''
+		Send queued commands, highest priority class first, for as long as
+		the socket takes them without blocking and the limiter allows.
+		Whatever does not go stays queued for the next call. Returns the
+		types of the commands that went stale in the queue and were dropped.
+		'''
+		dropped = []
+		if self.partial and not self.sendSome(self.partial):
+			return dropped
+		now = time.time()
+		for queue in self.outbound:
+			if not self.flushQueue(queue, now, dropped):
+				break
+		return dropped
+
+	def flushQueue(self, queue, now, dropped):
+		'''
+		flush() for one priority class; False once the socket is full
+		'''
+		held = []
+		try:
+			while queue:
+				deadline, messageType, frame, payload = queue[0]
+				if deadline is not None and now > deadline:
+					queue.popleft()
+					dropped.append(messageType)
+					self.limiter.dropped[messageType] += 1
+					continue
+				if not self.limiter.allow(messageType, now):
+					# out of tokens for its type; others behind it may still go
+					held.append(queue.popleft())
+					continue
+				sent = self.sendSome(frame)
+				if sent is None:
+					# nothing of it left, so it keeps its place in the queue
+					return False
+				queue.popleft()
+				self.limiter.take(messageType)
+				if self.on_sent:
+					self.on_sent(messageType, payload, now)
+				if not sent:
+					return False
+			return True
+		finally:
+			queue.extendleft(reversed(held))
+
+	def sendSome(self, data):
+		'''
+		Send as much of data as the socket takes without blocking. The rest
+		is kept in self.partial. Returns True if all of it went, False if some
+		did and None if none did.
+		'''
+		try:
+			if ServerComms.DONTWAIT is not None:
+				sent = self.ServerSocket.send(data, ServerComms.DONTWAIT)
 			else:
-				message.append(0)
+				# no such flag on Windows, and switching the socket to non-blocking
+				# would race a reader thread: send only once it says there is room
+				_, writable, _ = select.select([], [self.ServerSocket], [], 0)
+				sent = self.ServerSocket.send(data) if writable else 0
+		except BlockingIOError:
+			sent = 0
+		if sent == 0:
+			return None
+		self.partial = data[sent:]
+		return not self.partial
+
+	def backlog(self):
+		'''
+		Bytes of commands not on the wire yet: (queued here, waiting in the
+		kernel's send buffer). The latter is None where we cannot tell.
+		'''
+		queued = len(self.partial) + sum(len(frame) for queue in self.outbound for _, _, frame, _ in queue)
+		if fcntl is None:
+			return queued, None
+		try:
+			unsent = struct.unpack('i', fcntl.ioctl(self.ServerSocket.fileno(), termios.TIOCOUTQ, b'\0' * 4))[0]
+		except (OSError, ValueError, AttributeError):
+			unsent = None
+		return queued, unsent
 
-			logging.debug('Turned message type {} payload {} into {}'.format(
-				self.MessageTypes.toString(messageType),
-				messagePayload,
-				binascii.hexlify(message)))
-			return self.ServerSocket.sendall(message)
 
 class Bot(Thread):
 	CIRCLE = 1
-	AMMO_PICKUP = 2
+	PICKUP = 2
 	BANKING = 3
 	SEEK_SNITCH = 4
 	SNITCH_KILL = 5
@@ -172,216 +398,549 @@ class Bot(Thread):
 	HOOKED_ENEMY = 11
 	HOOKED_SNITCH = 12
 
-	def __init__(self, hostname, port, team_name, index):
+	GOAL_POSTS = (Point(0, 100), Point(0, -100))
+	# degrees ahead of the scheduled point that goCircle may pick to dodge threats
+	CIRCLE_LOOKAHEAD = (0, 20, 40)
+	# seconds ahead of the snitch's last sighting that SEEK_SNITCH aims for
+	SNITCH_LEAD = 0.5
+
+	# re-run the decision at least this often (seconds) even if nothing relevant changed,
+	# since goCircle's target moves with time
+	MAX_IDLE = 0.5
+
+	# commands within these tolerances of the last one sent are not re-sent,
+	# unless RESEND_INTERVAL seconds have passed
+	HEADING_TOLERANCE = 1.
+	TARGET_TOLERANCE = 1.
+	RESEND_INTERVAL = 1.
+
+	# commands whose effect shows up in our OBJECTUPDATEs, timed for the latency estimate
+	LATENCY_PROBES = {
+		ServerMessageTypes.TURNTOHEADING: 'heading',
+		ServerMessageTypes.TURNTURRETTOHEADING: 'turret',
+	}
+	# units per second an enemy is assumed to move along its heading, when leading shots
+	ENEMY_SPEED = 10.
+
+	# only fire when the turret is predicted to be this close (degrees) to the aim
+	FIRE_TOLERANCE = 5.
+	# starting guess for the turret slew speed (degrees/s) until we have observed it
+	TURRET_SPEED = 90.
+	# clearance kept between a shot and a teammate
+	TANK_RADIUS = 4.
+	# tracked enemies are only hooked and shot at while their position is this
+	# certain (standard deviation, units), about the size of a tank
+	AIM_SIGMA = 4.
+
+	# commands of each type a tick may send, unless the behaviour's budget says otherwise
+	COMMAND_BUDGET = 1
+	# per message type (None for all together): (commands per second, burst) a tank may send
+	COMMAND_LIMITS = {None: (40., 10.)}
+	# bytes of unsent commands (ours and the kernel's) above which the connection counts as congested
+	BACKLOG_WARNING = 1024
+	# last_sent kind to forget when a command of this type is dropped by the budget
+	COMMAND_KINDS = {
+		ServerMessageTypes.TURNTOHEADING: 'heading',
+		ServerMessageTypes.MOVEFORWARDDISTANCE: 'move',
+		ServerMessageTypes.TOGGLETURRETLEFT: 'turret',
+		ServerMessageTypes.TURNTURRETTOHEADING: 'turret',
+	}
+
+	def __init__(self, hostname, port, team_name, index, tick_rate=20., conflate=False, split_io=False, shared=None, connect=True, limits=None):
 		Thread.__init__(self)
 		self.name = "{}:{}".format(team_name, index)
 		self.index = index
-		self.gameserver = ServerComms(hostname, port)
-		self.gameserver.sendMessage(ServerMessageTypes.CREATETANK, {'Name': self.name})
+		self.tick_interval = 1. / tick_rate
+		# drain the socket and keep only the newest update per object before deciding
+		self.conflate = conflate
+		# with split_io a separate Reader thread owns the socket's receive side
+		self.inbox = None
+		self.reader = None
+		# estimated from TurretHeading updates, kept across respawns
+		self.turret_speed = Bot.TURRET_SPEED
+		# set when an event arrives that should be acted on before the next tick
+		self.triggered = False
+		# from our commands to the server acting on them, kept across respawns
+		self.latency = LatencyEstimator(self.name, field.latency_log)
+		# plays our commands forward from the last update
+		self.reckoning = PoseEstimator()
+		# world table shared with the other tank processes, if they run in their own
+		self.shared = shared
+		# a tank driven by another process is only a local record of its state
+		self.gameserver = None
+		if connect:
+			# limits given only override the defaults they name
+			merged = dict(Bot.COMMAND_LIMITS)
+			merged.update(limits or {})
+			limiter = CommandLimiter(merged)
+			self.gameserver = ServerComms(hostname, port, limiter)
+			self.gameserver.on_sent = self.commandSent
+			self.gameserver.sendMessage(ServerMessageTypes.CREATETANK, {'Name': self.name})
+		if split_io and connect:
+			self.inbox = Inbox(lambda message: message['messageType'] == ServerMessageTypes.OBJECTUPDATE)
+			self.reader = Reader("{} reader".format(self.name), self.readMessage, self.inbox)
+
+		# commands sent so far in the current tick, by type; None outside ticks
+		self.tick_sent = None
+		# whether the outbound backlog was over BACKLOG_WARNING at the last flush
+		self.congested = False
+		# (method, args) other threads asked this bot to run, taken at the start of a tick
+		self.requests = deque()
+
+		self.movement = StateMachine('movement', {
+			Bot.CIRCLE: Behaviour(self.doCircle),
+			Bot.PICKUP: Behaviour(self.doPickup),
+			Bot.BANKING: Behaviour(self.doBanking),
+			Bot.SEEK_SNITCH: Behaviour(self.doSeekSnitch, enter=self.enterSeekSnitch, exit=self.exitSeekSnitch),
+			Bot.SNITCH_KILL: Behaviour(self.doSnitchKill),
+		}, Bot.CIRCLE)
+		self.movement.addRule(20, Bot.BANKING, self.wantsToBank)
+		self.movement.addRule(10, Bot.PICKUP, self.hasPickup)
+
+		self.aiming = StateMachine('turret', {
+			Bot.RADAR: Behaviour(self.doRadar, budget={ServerMessageTypes.FIRE: 0}),
+			Bot.HOOKED_ENEMY: Behaviour(self.doHookedEnemy),
+			Bot.HOOKED_SNITCH: Behaviour(self.doHookedSnitch, budget={ServerMessageTypes.FIRE: 0}),
+		}, Bot.RADAR)
 		self.reset()
 	
 	def reset(self):
 		self.is_alive = True
-		self.state = Bot.CIRCLE
-		self.hookup_state = Bot.RADAR
+		# set by the Field when an update relevant to this tank arrives
+		self.stale = True
+		self.movement.reset()
+		self.aiming.reset()
 		self.hooked_objective = None
 		self.i = 0.
-		self.X = 0.
-		self.Y = 0.
-		self.last_X = 0.
-		self.last_Y = 0.
-		self.heading = 0.
-		self.turret_heading = 0.
-		self.ammo = 10
-		self.health = 3
+		self.tank = TankState()
+		self.latency.forget()
+		self.reckoning.forget()
+		# where the tank is predicted to be this tick; decisions steer and aim from it
+		self.pose = self.tank
 		self.expected_heading = None
 		self.kill_counter = 0
-
-	def update(self, X, Y, heading, turret_heading, health, ammo):
-		self.X = X
-		self.Y = Y
-		self.heading = heading
-		self.turret_heading = turret_heading
-		self.ammo = ammo
-		self.health = health
+		# command kind -> (value, time) of the last one sent to the server
+		self.last_sent = {}
+		self.world = field.view
+
+	@property
+	def state(self):
+		return self.movement.state
+
+	@property
+	def hookup_state(self):
+		return self.aiming.state
+
+	def update(self, state):
+		old = self.tank
+		self.tank = state
+		self.latency.observed('heading', state.heading, state.time)
+		self.latency.observed('turret', state.turret_heading, state.time)
+		self.reckoning.observed(state)
+		dt = state.time - old.time
+		if old.id == state.id and 0.01 < dt < 1.:
+			slew = angle_diff(state.turret_heading, old.turret_heading) / dt
+			# only learn from updates where the turret was actually turning
+			if slew > 1.:
+				self.turret_speed = 0.8 * self.turret_speed + 0.2 * slew
+
+	def commandSent(self, mtype, payload, now):
+		kind = Bot.LATENCY_PROBES.get(mtype)
+		if kind:
+			self.latency.commandSent(kind, payload['Amount'], now)
+		if mtype == ServerMessageTypes.TOGGLETURRETLEFT:
+			# turning for good, there is no heading to stop at
+			self.reckoning.commanded('turret', None)
+		elif mtype in Bot.COMMAND_KINDS:
+			self.reckoning.commanded(Bot.COMMAND_KINDS[mtype], payload['Amount'])
 
 	def kill(self):
 		self.is_alive = False
+		if self.reader:
+			self.reader.kill()
+		if self.gameserver:
+			logging.info("{} commands: {}".format(self.name, self.gameserver.limiter.summary(ServerMessageTypes.strings)))
 
 	def run(self):
+		if self.reader:
+			self.reader.start()
+		next_tick = time.time()
+		last_decision = 0.
 		while self.is_alive:
-			self.execute_next()
-			self.execute_next_turret()
+			self.ingest(next_tick)
+			if self.gameserver.hasOutbound():
+				# left over from a flush the socket could not take in full
+				self.flushCommands()
+			now = time.time()
+			if now < next_tick and not self.triggered:
+				continue
+			next_tick = now + self.tick_interval
+			if self.shared:
+				self.merge()
+			if self.triggered or self.stale or now - last_decision >= Bot.MAX_IDLE:
+				self.triggered = False
+				self.stale = False
+				last_decision = now
+				self.tick_sent = {}
+				self.takeRequests()
+				self.execute_next()
+				self.execute_next_turret()
+				self.flushCommands()
+				self.tick_sent = None
+
+	def request(self, action, *args):
+		'''
+		Have this bot run action(self, *args) at the start of its next tick,
+		so that the Field (on any bot's thread) never changes its state
+		machines in the middle of one. A tank driven by another process has
+		no ticks, so it is applied straight away.
+		'''
+		if self.gameserver is None:
+			action(self, *args)
+			return
+		self.requests.append((action, args))
+		self.triggered = True
+
+	def takeRequests(self):
+		while self.requests:
+			action, args = self.requests.popleft()
+			action(self, *args)
+
+	def ingest(self, deadline):
+		'''
+		Feed every message waiting on the socket into the field, blocking
+		until deadline at most for the first one. Returns early on events
+		(anything but an OBJECTUPDATE) so that they are acted on straight away.
+
+		In conflate mode everything buffered is read at once and only the
+		newest OBJECTUPDATE per object is applied, so a tank that fell
+		behind catches up in one pass. With split I/O the messages come
+		from the reader thread's inbox instead of the socket.
+		'''
+		timeout = max(0., deadline - time.time())
+		if self.inbox:
+			self.inbox.wait(timeout)
+			messages = self.inbox.drain()
+			self.apply(conflate(messages) if self.conflate else messages)
+			return
+
+		while self.gameserver.hasMessage(timeout):
+			if self.conflate:
+				messages = conflate(self.gameserver.readAvailable())
+			else:
+				messages = [self.readMessage()]
+			self.apply(messages)
+			if self.triggered or time.time() >= deadline:
+				break
+			timeout = 0.
+
+	def apply(self, messages):
+		for message in messages:
+			field.update(message, self.index)
+			if message['messageType'] == ServerMessageTypes.GAMETIMEUPDATE:
+				continue
+			if message['messageType'] != ServerMessageTypes.OBJECTUPDATE:
+				self.triggered = True
+			if self.shared:
+				self.shared.publish(message, field.observedAt(message, self.index))
+
+	def merge(self):
+		'''
+		Apply the updates and events the other tank processes received since
+		the last call, as if they had arrived on their connections
+		'''
+		for index, event in self.shared.changes():
+			field.update(event, index)
 
 	def readMessage(self):
 		return self.gameserver.readMessage()
 	
 	def sendMessage(self, mtype, payload=None):
-		self.gameserver.sendMessage(mtype, payload)
+		if self.tick_sent is not None:
+			sent = self.tick_sent.get(mtype, 0)
+			if sent >= self.budgetFor(mtype):
+				logging.debug("{} over budget, dropping {}".format(self.name, ServerMessageTypes().toString(mtype)))
+				# it never reached the server, so it must not suppress the next one
+				self.last_sent.pop(Bot.COMMAND_KINDS.get(mtype), None)
+				return
+			self.tick_sent[mtype] = sent + 1
+		if self.gameserver is None:
+			# another process drives this tank and makes its own decisions
+			return
+		# commands of a tick go out together at its end, most urgent first
+		self.gameserver.queue(mtype, payload)
+		if self.tick_sent is None:
+			self.flushCommands()
+
+	def flushCommands(self):
+		for mtype in self.gameserver.flush():
+			logging.debug("{} dropped stale {}".format(self.name, ServerMessageTypes().toString(mtype)))
+			self.last_sent.pop(Bot.COMMAND_KINDS.get(mtype), None)
+		queued, unsent = self.gameserver.backlog()
+		congested = queued + (unsent or 0) > Bot.BACKLOG_WARNING
+		if congested != self.congested:
+			self.congested = congested
+			logging.info("{} outbound backlog {} bytes queued, {} in the send buffer{}".format(
+				self.name, queued, unsent, " - congested" if congested else ""))
+
+	def budgetFor(self, mtype):
+		for machine in (self.movement, self.aiming):
+			behaviour = machine.current
+			if behaviour and mtype in behaviour.budget:
+				return behaviour.budget[mtype]
+		return Bot.COMMAND_BUDGET
 
 	def execute_next(self):
-		message = self.readMessage()
-		field.update(message, self.index)
+		# one consistent view of the field for the whole tick
+		self.world = field.view
+		self.pose = self.reckoning.predict(time.time(), self.turret_speed, field.lastSeen(self.tank))
 
 		logging.debug("{} I am in state {}".format(self.name, self.state))
 		logging.info("{} Kill points: {}".format(self.name, self.kill_counter))
 
-		if self.state == Bot.CIRCLE:
-			self.goCircle(0, -70, 30)
-			
-		if self.state == Bot.AMMO_PICKUP:
-			if self.hooked_objective and type(self.hooked_objective) == type(tuple()):
-				self.moveTo(self.hooked_objective[0], self.hooked_objective[1])
-			else:
-				self.state = Bot.CIRCLE
-		
-		if self.kill_counter > 0: # TODO: change this
-			self.state = Bot.BANKING
-
-		if self.state == Bot.SEEK_SNITCH:
-			self.hookup_state = Bot.HOOKED_SNITCH
-			if field.snitch:
-				self.moveTo(field.snitch[0], field.snitch[1])
-
-		if self.state == Bot.BANKING:
-			goal_posts = [(0, 100), (0, -100)]
-			closest_goal_post = min(goal_posts, key=lambda post: distance(self.X, self.Y, post[0], post[1]))
-			self.moveTo(closest_goal_post[0], closest_goal_post[1])
-
-		if self.state == Bot.SNITCH_KILL and self.hooked_objective:
-			self.moveTo(self.hooked_objective[0], self.hooked_objective[1], -20)
+		self.movement.tick()
 
 		self.i += 1
-	
+
 	def execute_next_turret(self):
 		logging.debug("Turret state {}".format(self.hookup_state))
-		logging.debug("No of ammos: {}".format(self.ammo))
+		logging.debug("No of ammos: {}".format(self.tank.ammo))
 
-		if self.hookup_state == Bot.RADAR:
-			self.radarTurret()
+		self.aiming.tick()
 
-			if self.ammo == 0:
-				logging.info("Run out of ammo")
-				if self.hooked_objective == None and len(field.ammo_pickups) and self.state != Bot.AMMO_PICKUP:
-					closest_ammo = min(field.ammo_pickups, key=lambda x: distance(self.X, self.Y, x[0], x[1]))
-					logging.info("Found this ammo: {}".format(closest_ammo))
-					self.hooked_objective = closest_ammo
-					self.state = Bot.AMMO_PICKUP
-				elif self.hooked_objective != None and self.hooked_objective not in field.ammo_pickups:
-					logging.info("Unexisting ammo, unhooking")
-					self.hooked_objective = None
-					self.unhook()
+	def wantsToBank(self):
+		return self.kill_counter > 0 and field.banking.shouldBank(self.kill_counter, self.pose.x, self.pose.y,
+			self.tank.health, field.threat.danger(self.pose.x, self.pose.y), self.index)
 
-			if self.ammo > 0:
-				logging.info("There are {} known enemies. My hooked object is {}".format(len(field.enemies), self.hooked_objective))
-				if len(field.enemies):
-					logging.info("Looking for an enemy...")
-					closest_enemy = min(field.enemies.keys(), key=lambda x: distance(self.X, self.Y, field.enemies[x][0], field.enemies[x][1]))
-					x_enemy, y_enemy = field.enemies[closest_enemy][:2]
-					if distance(self.X, self.Y, x_enemy, y_enemy) < 70:
-						logging.info("Hooked an enemy! {}".format(closest_enemy))
-						self.hooked_objective = closest_enemy
-						self.hookup_state = Bot.HOOKED_ENEMY
-
-		if self.hookup_state == Bot.HOOKED_ENEMY:
-			if self.ammo == 0:
+	def hasPickup(self):
+		return self.state == Bot.CIRCLE and field.logistics.assignment(self.index) is not None
+
+	def doCircle(self):
+		self.goCircle(0, -70, 30)
+
+	def doPickup(self):
+		# reserved for us by the team's logistics planner
+		pickup = field.logistics.assignment(self.index)
+		if pickup:
+			self.moveTo(pickup.x, pickup.y)
+		else:
+			self.movement.transition(Bot.CIRCLE)
+
+	def enterSeekSnitch(self):
+		self.aiming.transition(Bot.HOOKED_SNITCH)
+
+	def exitSeekSnitch(self):
+		if self.hookup_state == Bot.HOOKED_SNITCH:
+			self.unhook()
+
+	def doSeekSnitch(self):
+		target = field.snitch_tracker.predict(time.time() + Bot.SNITCH_LEAD)
+		if target:
+			self.moveTo(target[0], target[1])
+
+	def doBanking(self):
+		closest_goal_post, _ = nearest(self.pose.x, self.pose.y, Bot.GOAL_POSTS)
+		self.moveTo(closest_goal_post.x, closest_goal_post.y)
+
+	def doSnitchKill(self):
+		carrier = self.world.enemies.get(self.hooked_objective)
+		if carrier:
+			self.moveTo(carrier.x, carrier.y, -20)
+
+	def doRadar(self):
+		self.radarTurret()
+
+		if self.tank.ammo > 0:
+			logging.info("There are {} known enemies. My hooked object is {}".format(len(self.world.enemies), self.hooked_objective))
+			if len(self.world.enemies):
+				logging.info("Looking for an enemy...")
+				targets = self.aimable(self.world.enemies.values(), time.time())
+				# rather one this tank sees itself: its own reports of it are the freshest
+				own = [e for e in targets if self.index in field.seenBy(e.id)]
+				closest_enemy, enemy_distance = nearest(self.pose.x, self.pose.y, own or targets)
+				if enemy_distance < 70:
+					logging.info("Hooked an enemy! {}".format(closest_enemy.id))
+					self.hooked_objective = closest_enemy.id
+					self.aiming.transition(Bot.HOOKED_ENEMY)
+
+	def doHookedEnemy(self):
+		if self.tank.ammo == 0:
+			self.unhook()
+		else:
+			if self.hooked_objective == None or self.hooked_objective not in self.world.enemies:
 				self.unhook()
 			else:
-				if self.hooked_objective == None or self.hooked_objective not in field.enemies:
+				target = self.aimable([self.world.enemies[self.hooked_objective]], time.time())
+				if not target or distance(self.pose.x, self.pose.y, target[0].x, target[0].y) > 80:
 					self.unhook()
 				else:
-					x_enemy, y_enemy = field.enemies[self.hooked_objective][:2]
-					if distance(self.X, self.Y, x_enemy, y_enemy) > 80:
-						self.unhook()
-					else:
-						self.rotateToShoot()
-						#self.rotateTurretTo(x_enemy, y_enemy)
+					aim = self.rotateToShoot()
+					#self.rotateTurretTo(x_enemy, y_enemy)
+					if self.turretAlignedWith(aim) and not self.teammateInLine(target[0].x, target[0].y):
 						self.fire()
-		
-		if self.hookup_state == Bot.HOOKED_SNITCH:
-			if field.snitch:
-				self.hooked_objective = field.snitch
-				x_snitch, y_snitch = field.snitch
-				self.rotateTurretTo(x_snitch, y_snitch)
-			else:
-				self.radarTurret()
-				
+
+	def aimable(self, enemies, when):
+		'''
+		Where the given enemies are at time when, as objects with id/x/y,
+		leaving out the tracks too uncertain to aim at. Untracked enemies
+		are taken as last reported.
+		'''
+		enemies = list(enemies)
+		if not field.tracker:
+			return enemies
+		estimates = field.tracker.estimates(when, [e.id for e in enemies])
+		return [e for e in estimates.values() if e.sigma < Bot.AIM_SIGMA]
+
+	def doHookedSnitch(self):
+		if self.world.snitch:
+			self.hooked_objective = self.world.snitch
+			self.rotateTurretTo(self.world.snitch.x, self.world.snitch.y)
+		else:
+			self.radarTurret()
+
+	def shouldSend(self, kind, value, same):
+		'''
+		Record value as the latest command of this kind, unless same(last, value)
+		says it would not change what the server is already doing
+		'''
+		now = time.time()
+		last = self.last_sent.get(kind)
+		if last and now - last[1] < Bot.RESEND_INTERVAL and same(last[0], value):
+			return False
+		self.last_sent[kind] = (value, now)
+		return True
+
+	@staticmethod
+	def sameHeading(a, b):
+		return angle_diff(a, b) < Bot.HEADING_TOLERANCE
+
+	@staticmethod
+	def sameTarget(a, b):
+		return a[2] == b[2] and distance(a[0], a[1], b[0], b[1]) < Bot.TARGET_TOLERANCE
+
+	@staticmethod
+	def sameTurretMode(a, b):
+		return a[0] == b[0] and (a[1] is None or Bot.sameHeading(a[1], b[1]))
+
 	def moveTo(self, new_x, new_y, offset = 0):
-		dist = distance(self.X, self.Y, new_x, new_y) + offset
-		degree = rotate_head(self.X, self.Y, new_x, new_y)
+		if not self.shouldSend('move', (new_x, new_y, offset), Bot.sameTarget):
+			return
+		dist = distance(self.pose.x, self.pose.y, new_x, new_y) + offset
+		degree = rotate_head(self.pose.x, self.pose.y, new_x, new_y)
 		self.rotateByDeg(-degree, absolute=True)
 		self.moveForward(dist) 
 
 	def radarTurret(self):
-		self.sendMessage(ServerMessageTypes.TOGGLETURRETLEFT, {'Amount': (self.turret_heading + 60) % 360})
+		if self.shouldSend('turret', ('radar', None), Bot.sameTurretMode):
+			self.sendMessage(ServerMessageTypes.TOGGLETURRETLEFT, {'Amount': (self.tank.turret_heading + 60) % 360})
 
 	def rotateToShoot(self):
 		if self.hooked_objective:
-			new_x = self.X + math.cos(deg2rad(self.heading))*2
-			new_y = self.Y + math.sin(deg2rad(self.heading))*2
+			trig = tools.trig
+			new_x = self.pose.x + trig.cos(self.pose.heading)*2
+			# server headings run clockwise: heading h points along (cos h, -sin h)
+			new_y = self.pose.y - trig.sin(self.pose.heading)*2
 
 
-			x_enemy, y_enemy, _, heading_enemy = field.enemies[self.hooked_objective][:4]
+			enemy = self.world.enemies[self.hooked_objective]
+			x_enemy, y_enemy = enemy.x, enemy.y
 
 			logging.info("{} Objective: {} {}".format(self.name, x_enemy, y_enemy))
 
-			x_enemy2 = x_enemy + math.cos(deg2rad(heading_enemy))*2
-			y_enemy2 = y_enemy + math.sin(deg2rad(heading_enemy))*2
+			# lead the enemy by where it gets to while our command reaches the server
+			when = time.time() + (self.latency.estimate or 0.)
+			track = field.tracker.estimate(enemy.id, when) if field.tracker else None
+			if track:
+				x_enemy2, y_enemy2 = track.x, track.y
+			else:
+				lead = 2 + Bot.ENEMY_SPEED * (self.latency.estimate or 0.)
+				x_enemy2 = x_enemy + trig.cos(enemy.heading)*lead
+				y_enemy2 = y_enemy - trig.sin(enemy.heading)*lead
 
 			degree = rotate_head(new_x, new_y, x_enemy2, y_enemy2)
 			degree = (-degree) % 360
 			logging.info("{} OOOOOOOOOOOOOOOOOOO {} {}".format(self.name, x_enemy, x_enemy2))
 
-			self.sendMessage(ServerMessageTypes.TURNTURRETTOHEADING, {'Amount': degree})
+			self.turnTurretTo(degree)
+			return degree
+
+	def turretAlignedWith(self, degree):
+		'''
+		Whether the turret, slewing towards degree since the last update, should
+		be within FIRE_TOLERANCE of it by now
+		'''
+		if degree is None:
+			return False
+		error = angle_diff(self.tank.turret_heading, degree)
+		error -= self.turret_speed * max(0., time.time() - field.lastSeen(self.tank))
+		return error <= Bot.FIRE_TOLERANCE
+
+	def teammateInLine(self, target_x, target_y):
+		x, y = self.pose.x, self.pose.y
+		for tank_no in field.team_grid.query_segment(x, y, target_x, target_y, Bot.TANK_RADIUS):
+			if tank_no == self.index:
+				continue
+			mate = bots[tank_no].tank
+			if segment_hits_circle(x, y, target_x, target_y, mate.x, mate.y, Bot.TANK_RADIUS):
+				logging.debug("{} holding fire, {} is in the way".format(self.name, bots[tank_no].name))
+				return True
+		return False
 
 	def fire(self):
 		self.sendMessage(ServerMessageTypes.FIRE)
 
 	def goCircle(self, rootX, rootY, radius=40, speed=1):
-		targetX, targetY = self.getOffsetInAngle(rootX, rootY, radius, (time.time() * 10*speed + self.index*90) % 360)
-		if self.index%2 == 0:
-			self.moveTo(targetX, targetY, offset=10)
-		else:
-			self.moveTo(targetX, -targetY, offset=10)
+		angle = time.time() * 10*speed + self.index*90
+		# skip ahead along the circle past arcs that enemies are covering
+		candidates = []
+		for ahead in Bot.CIRCLE_LOOKAHEAD:
+			targetX, targetY = self.getOffsetInAngle(rootX, rootY, radius, (angle + ahead) % 360)
+			candidates.append((targetX, targetY if self.index%2 == 0 else -targetY))
+		targetX, targetY = field.threat.safest(candidates)
+		self.moveTo(targetX, targetY, offset=10)
 
 
 	def getOffsetInAngle(self, baseX, baseY, radius, angle):
-		rangle = angle / 180 * math.pi
-		offsetX = math.sin(rangle) * radius
-		offsetY = -math.cos(rangle) * radius
+		offsetX = tools.trig.sin(angle) * radius
+		offsetY = -tools.trig.cos(angle) * radius
 		return (baseX + offsetX, baseY + offsetY)
 	
 	def rotateByDeg(self, degree, absolute=False):
 		if not absolute:
-			degree = self.heading - degree
+			degree = self.pose.heading - degree
 		self.expected_heading = degree
-		self.sendMessage(ServerMessageTypes.TURNTOHEADING, {'Amount': degree % 360})
+		if self.shouldSend('heading', degree % 360, Bot.sameHeading):
+			self.sendMessage(ServerMessageTypes.TURNTOHEADING, {'Amount': degree % 360})
 	
 	def rotateTo(self, new_x, new_y):
-		new_degree = rotate_head(self.X, self.Y, new_x, new_y)
+		new_degree = rotate_head(self.pose.x, self.pose.y, new_x, new_y)
 		self.rotateByDeg(-new_degree, absolute=True)
 	
 	def rotateTurretTo(self, new_x, new_y):
-		new_degree = rotate_head(self.X, self.Y, new_x, new_y)
+		new_degree = rotate_head(self.pose.x, self.pose.y, new_x, new_y)
 		new_degree = (-new_degree) % 360
-		self.sendMessage(ServerMessageTypes.TURNTURRETTOHEADING, {'Amount': new_degree})
+		self.turnTurretTo(new_degree)
+
+	def turnTurretTo(self, degree):
+		if self.shouldSend('turret', ('heading', degree), Bot.sameTurretMode):
+			self.sendMessage(ServerMessageTypes.TURNTURRETTOHEADING, {'Amount': degree})
 
 	def moveForward(self, amount):
-		self.gameserver.sendMessage(ServerMessageTypes.MOVEFORWARDDISTANCE, {'Amount': amount})
+		self.sendMessage(ServerMessageTypes.MOVEFORWARDDISTANCE, {'Amount': amount})
 	
 	def changeState(self, newState):
 		logging.info(self.state)
-		self.state = newState
+		self.movement.transition(newState)
 		logging.info(self.state)
 	
 	def unhook(self):
 		self.hooked_objective = None
-		self.hookup_state = Bot.RADAR
+		self.aiming.transition(Bot.RADAR)
 	
 	def snitchSeeker(self, carrier):
-		self.hookup_state = Bot.HOOKED_ENEMY
-		self.state = Bot.SNITCH_KILL
+		self.changeState(Bot.SNITCH_KILL)
 		self.hooked_objective = carrier
+		self.aiming.transition(Bot.HOOKED_ENEMY)
 	
 	def goBanking(self):
 		self.unhook()
@@ -389,127 +948,398 @@ class Bot(Thread):
 		
 	   
 class Field(Thread):
-	def __init__(self, team_name):
+	# OBJECTUPDATEs that move an object less than MOVE_THRESHOLD units and turn it
+	# less than TURN_THRESHOLD degrees only refresh its timestamp
+	MOVE_THRESHOLD = 1.
+	TURN_THRESHOLD = 2.
+	# enemy changes only invalidate tanks this close to them (or hooked on them)
+	INTEREST_RADIUS = 100.
+	# an identical OBJECTUPDATE arriving on another tank's connection within this
+	# many seconds is the same observation
+	DUPLICATE_WINDOW = 0.1
+	# a tank stops counting as seeing an object after this many seconds
+	SIGHTING_TIMEOUT = 1.
+	# enemies are given up once their tracked position is this uncertain (standard deviation, units)
+	LOST_SIGMA = 30.
+	# without tracking, once they have not been seen for this many seconds
+	ENEMY_TIMEOUT = 3.
+
+	def __init__(self, team_name, record_banking=None, record_latency=None, track_turns=False):
 		Thread.__init__(self)
 		self.team_name = team_name
-		self.enemies = {}
-		self.snitch = None
-		self.ammo_pickups = []
-		self.health_pickups = []
+		self.view = WorldView()
+		# only serialises writers; readers just grab self.view
+		self.write_lock = Lock()
+		# our own tanks by index, for line-of-fire checks
+		self.team_grid = SpatialGrid()
+		# where enemies have been aiming, shared by the whole team
+		self.threat = ThreatMap()
+		self.snitch_tracker = SnitchTracker()
+		self.logistics = LogisticsPlanner()
+		# object Id -> (payload key, time, connection index) of the last observation applied
+		self.last_observation = {}
+		# object Id -> {tank index: time it last reported the object}
+		self.sightings = {}
+		# object Id -> time of its latest report. Records are only replaced when
+		# something changed, so their own time is when that was; never touched in place
+		self.last_seen = {}
+		self.banking = BankingPolicy(record_path=record_banking)
+		self.latency_log = SampleLog(record_latency) if record_latency else None
+		# maps receive times to when the server sent things, from GAMETIMEUPDATEs
+		self.clock = ClockSync()
+		# filtered enemy positions and velocities, if NumPy is there for it
+		self.tracker = EnemyTracker(turn=track_turns) if tracking.available() else None
+		# set when the snitch was picked up by an enemy we have not seen yet
+		self.carrier_pending = False
 		self.is_running = True
-		self.snitch_owner = None
+
+		# (messageType, object Type) -> handler; non-OBJECTUPDATE messages have no Type
+		self.handlers = {}
+		self.register(ServerMessageTypes.OBJECTUPDATE, self.onTankUpdate, 'Tank')
+		self.register(ServerMessageTypes.OBJECTUPDATE, self.onHealthPickupUpdate, 'HealthPickup')
+		self.register(ServerMessageTypes.OBJECTUPDATE, self.onAmmoPickupUpdate, 'AmmoPickup')
+		self.register(ServerMessageTypes.OBJECTUPDATE, self.onSnitchUpdate, 'Snitch')
+		self.register(ServerMessageTypes.AMMOPICKUP, self.onAmmoPickup)
+		self.register(ServerMessageTypes.HEALTHPICKUP, self.onHealthPickup)
+		self.register(ServerMessageTypes.SNITCHPICKUP, self.onSnitchPickup)
+		self.register(ServerMessageTypes.ENTEREDGOAL, self.onEnteredGoal)
+		self.register(ServerMessageTypes.SNITCHAPPEARED, self.onSnitchAppeared)
+		self.register(ServerMessageTypes.KILL, self.onKill)
+		self.register(ServerMessageTypes.HITDETECTED, self.onHitDetected)
+		self.register(ServerMessageTypes.DESTROYED, self.onDestroyed)
+		self.register(ServerMessageTypes.GAMETIMEUPDATE, self.onGameTimeUpdate)
 
 	def run(self):
 		while self.is_running:
 			time.sleep(1)
-			to_delete = []
-			for enemy in self.enemies:
-				if time.time() - self.enemies[enemy][2] > 3:
-					to_delete.append(enemy)
-			for x in to_delete:
-				del self.enemies[x]
-			to_delete.clear()
-			
-			self.ammo_pickups = list(filter(lambda x: time.time() - x[2] <= 5, self.ammo_pickups))
+			now = time.time()
+			view = self.view
+			if self.tracker:
+				lost = self.tracker.lost(now, Field.LOST_SIGMA)
+				for enemy_id in lost:
+					self.tracker.forget(enemy_id)
+				self.modify('enemies', drop=lost)
+			else:
+				self.modify('enemies', drop=[e.id for e in view.enemies.values() if now - self.lastSeen(e) > Field.ENEMY_TIMEOUT])
+			self.dropPickups('ammo_pickups', [p.id for p in view.ammo_pickups.values() if now - self.lastSeen(p) > 5])
+			self.dropPickups('health_pickups', [p.id for p in view.health_pickups.values() if now - self.lastSeen(p) > 5])
+			with self.write_lock:
+				for elem_id, (_, seen, _) in list(self.last_observation.items()):
+					if now - seen > 10:
+						del self.last_observation[elem_id]
+						self.sightings.pop(elem_id, None)
+			for elem_id, seen in list(self.last_seen.items()):
+				if now - seen > 10:
+					self.last_seen.pop(elem_id, None)
 
 	def kill(self):
 		self.is_running = False
 
-	def update(self, event, index):
-		messageType = event['messageType']
-		if messageType == ServerMessageTypes.OBJECTUPDATE:
-			elem_id = event['Id']
-			if event['Type'] == 'Tank':
-				x, y = event['X'], event['Y']
-				heading = event['Heading']
-				turret_heading = event['TurretHeading']
-				health = event['Health']
-				ammo = event['Ammo']
-
-				# if it's a member of mine
-				if event['Name'].startswith(self.team_name):
-					tank_no = int(event['Name'][-1])
-					bots[tank_no].update(x, y, heading, turret_heading, health, ammo)
-					id2bot_no[elem_id] = tank_no
-				else:
-					if health == 0 and elem_id in self.enemies:
-						del self.enemies[elem_id]
-					else:
-						self.enemies[elem_id] = (x, y, time.time(), heading, turret_heading, health, ammo)
-				
-					if elem_id == self.snitch_owner and health == 0:
-						snitch_owner = None
-						self.snitchAppears()
-
-			elif event['Type'] == 'HealthPickup':
-				self.health_pickups.append((event['X'], event['Y'], time.time()))
-
-			elif event['Type'] == 'AmmoPickup':
-				self.ammo_pickups.append((event['X'], event['Y'], time.time()))
-			elif event['Type'] == 'Snitch':
-				self.snitch = (event['X'], event['Y'])
-
-		elif messageType == ServerMessageTypes.AMMOPICKUP:
-			logging.info("Grabbed object")
-			bots[index].ammo = 10
-			if bots[index].state == Bot.AMMO_PICKUP:
-				bots[index].changeState(Bot.CIRCLE)
-			bots[index].hooked_objective = None
-
-			to_delete_pickups = []
-			for p in filter(lambda x: x[0] == 'Ammo', self.ammo_pickups):
-				if math.hypot(bot.X - p[1], bot.Y - p[2]) < 10:
-					to_delete_pickups.append(p)
-
-			for to_delete in to_delete_pickups:
-				self.ammo_pickups.remove(to_delete)
-		
-		elif messageType == ServerMessageTypes.SNITCHPICKUP:
-			self.snitch_owner = event['Id']
-			self.assignCarrier()
-			# if I know this enemy then assign this task to the 2 closest bots
+	@property
+	def enemies(self):
+		return self.view.enemies
 
-		elif messageType == ServerMessageTypes.ENTEREDGOAL:
-			bots[index].changeState(Bot.CIRCLE)
-			bots[index].kill_counter = 0
+	@property
+	def ammo_pickups(self):
+		return self.view.ammo_pickups
 
-		elif messageType == ServerMessageTypes.SNITCHAPPEARED:
-			best_healthy_bots = sorted(bots, key=lambda x: x.health, reverse=True)
-			best_healthy_bots[0].changeState(Bot.SEEK_SNITCH)
-			best_healthy_bots[1].changeState(Bot.SEEK_SNITCH)
+	@property
+	def health_pickups(self):
+		return self.view.health_pickups
 
-		elif messageType == ServerMessageTypes.KILL:
-			self.enemies.clear()
-			bots[index].unhook()
-			bots[index].kill_counter += 1
+	@property
+	def snitch(self):
+		return self.view.snitch
 
-		elif messageType == ServerMessageTypes.HITDETECTED:
-			#bots[index].recover()
-			pass
+	@property
+	def snitch_owner(self):
+		return self.snitch_tracker.carrier
+
+	def publish(self, **changes):
+		'''
+		Swap in a new view with the given fields replaced
+		'''
+		with self.write_lock:
+			self.view = self.view.replace(**changes)
+
+	def modify(self, name, put=None, drop=()):
+		'''
+		Copy-on-write update of one of the view's collections: add/replace
+		the record put (keyed by its id) and remove the ids in drop.
+		'''
+		with self.write_lock:
+			view = self.view
+			current = getattr(view, name)
+			if put is None and not any(key in current for key in drop):
+				return
+			items = dict(current)
+			if put is not None:
+				items[put.id] = put
+			for key in drop:
+				items.pop(key, None)
+			self.view = view.replace(**{name: items})
+
+	def register(self, messageType, handler, objectType=None):
+		'''
+		Register handler(event, index) for a message type. OBJECTUPDATEs are
+		further keyed by their 'Type' field.
+		'''
+		self.handlers[(messageType, objectType)] = handler
 
-		elif messageType == ServerMessageTypes.DESTROYED:
-			logging.info("Bot {} has died!".format(bots[index].name))
-			bots[index].reset()
-			if self.snitch_owner:
-				self.assignCarrier()
+	def update(self, event, index):
+		if event['messageType'] == ServerMessageTypes.OBJECTUPDATE and (
+				self.isDuplicate(event, index) or self.isOutdated(event, index)):
+			return
+		handler = self.handlers.get((event['messageType'], event.get('Type')))
+		if handler:
+			handler(event, index)
+
+	def isDuplicate(self, event, index):
+		'''
+		Record that tank index sees this object, and tell whether the same
+		observation already came in through a teammate's connection
+		'''
+		elem_id = event['Id']
+		now = time.time()
+		key = (event['X'], event['Y'], event.get('Heading'), event.get('TurretHeading'), event.get('Health'), event.get('Ammo'))
+		# every bot's thread comes through here, and run() prunes both tables
+		with self.write_lock:
+			seen = self.sightings.get(elem_id)
+			if seen is None:
+				seen = self.sightings[elem_id] = {}
+			seen[index] = now
+
+			last = self.last_observation.get(elem_id)
+			if last and last[0] == key and last[2] != index and now - last[1] < Field.DUPLICATE_WINDOW:
+				return True
+			self.last_observation[elem_id] = (key, now, index)
+			return False
+
+	def isOutdated(self, event, index):
+		'''
+		Whether a teammate's connection already reported this object as it
+		was more recently, so that a lagging connection cannot roll it back
+		'''
+		return self.observedAt(event, index) < self.last_seen.get(event['Id'], 0.)
+
+	def seenBy(self, elem_id):
+		'''
+		Indices of our tanks currently seeing an object
+		'''
+		now = time.time()
+		with self.write_lock:
+			seen = list(self.sightings.get(elem_id, {}).items())
+		return [index for index, t in seen if now - t < Field.SIGHTING_TIMEOUT]
+
+	def lastSeen(self, record):
+		'''
+		Time of the latest report of the object a record describes
+		'''
+		return max(record.time, self.last_seen.get(record.id, 0.))
 
-			elif self.snitch:
+	def observedAt(self, event, index):
+		'''
+		Local time at which the server reported what event describes
+		'''
+		if 'observed' in event:
+			# merged in from another process, which worked it out already
+			return event['observed']
+		received = event.get('received')
+		if received is None:
+			return time.time()
+		return self.clock.observedAt(received, index)
+
+	def hasChanged(self, old, event):
+		'''
+		Whether an OBJECTUPDATE differs enough from the record we hold to be
+		worth a new decision
+		'''
+		if old is None:
+			return True
+		if abs(old.x - event['X']) >= Field.MOVE_THRESHOLD or abs(old.y - event['Y']) >= Field.MOVE_THRESHOLD:
+			return True
+		if 'Heading' not in event:
+			return False
+		return (angle_diff(old.heading, event['Heading']) >= Field.TURN_THRESHOLD
+			or angle_diff(old.turret_heading, event['TurretHeading']) >= Field.TURN_THRESHOLD
+			or old.health != event['Health']
+			or old.ammo != event['Ammo'])
+
+	def invalidateAll(self):
+		for bot in bots:
+			bot.stale = True
+
+	def invalidateNear(self, enemy):
+		for bot in bots:
+			if bot.hooked_objective == enemy.id or distance(bot.tank.x, bot.tank.y, enemy.x, enemy.y) <= Field.INTEREST_RADIUS:
+				bot.stale = True
+
+	def onTankUpdate(self, event, index):
+		elem_id = event['Id']
+		health = event['Health']
+		now = self.observedAt(event, index)
+
+		# if it's a member of mine
+		if event['Name'].startswith(self.team_name):
+			tank_no = int(event['Name'][-1])
+			bot = bots[tank_no]
+			self.last_seen[elem_id] = now
+			if bot.tank.id != elem_id or self.hasChanged(bot.tank, event):
+				bot.update(TankState(elem_id, event['X'], event['Y'], event['Heading'],
+					event['TurretHeading'], health, event['Ammo'], now))
+				bot.stale = True
+				if health > 0:
+					self.team_grid.move(tank_no, event['X'], event['Y'])
+				else:
+					self.team_grid.remove(tank_no)
+				self.snitch_tracker.tankMoved(tank_no, event['X'], event['Y'], health)
+				self.logistics.tankChanged(tank_no, event['X'], event['Y'], event['Ammo'], health)
+			id2bot_no[elem_id] = tank_no
+		else:
+			old = self.view.enemies.get(elem_id)
+			if self.tracker:
+				if health == 0:
+					self.tracker.forget(elem_id)
+				else:
+					# unchanged reports count too: they tell the filter the enemy is standing still
+					self.tracker.observe(elem_id, event['X'], event['Y'], event['Heading'], now)
+			if health == 0:
+				self.threat.forget(elem_id)
+				self.last_seen.pop(elem_id, None)
+				if old:
+					self.modify('enemies', drop=[elem_id])
+					self.invalidateNear(old)
+			else:
+				self.last_seen[elem_id] = now
+			if health > 0 and self.hasChanged(old, event):
+				enemy = EnemyState(elem_id, event['X'], event['Y'], now,
+					event['Heading'], event['TurretHeading'], health, event['Ammo'])
+				self.modify('enemies', put=enemy)
+				self.threat.observe(enemy)
+				self.invalidateNear(enemy)
+				if elem_id == self.snitch_owner:
+					self.snitch_tracker.carrierMoved(enemy)
+					if self.carrier_pending:
+						self.assignCarrier()
+
+			if elem_id == self.snitch_owner and health == 0:
+				self.snitch_tracker.dropped()
 				self.snitchAppears()
 
+	def onHealthPickupUpdate(self, event, index):
+		old = self.view.health_pickups.get(event['Id'])
+		now = self.observedAt(event, index)
+		self.last_seen[event['Id']] = now
+		if self.hasChanged(old, event):
+			pickup = Pickup(event['Id'], event['X'], event['Y'], now)
+			self.modify('health_pickups', put=pickup)
+			self.logistics.pickupAppeared(pickup, LogisticsPlanner.HEALTH)
+
+	def onAmmoPickupUpdate(self, event, index):
+		old = self.view.ammo_pickups.get(event['Id'])
+		now = self.observedAt(event, index)
+		self.last_seen[event['Id']] = now
+		if self.hasChanged(old, event):
+			pickup = Pickup(event['Id'], event['X'], event['Y'], now)
+			self.modify('ammo_pickups', put=pickup)
+			self.logistics.pickupAppeared(pickup, LogisticsPlanner.AMMO)
+			self.invalidateAll()
+
+	def onSnitchUpdate(self, event, index):
+		old = self.view.snitch
+		now = self.observedAt(event, index)
+		self.last_seen[event['Id']] = now
+		if not old or old.id != event['Id'] or self.hasChanged(old, event):
+			snitch = Snitch(event['Id'], event['X'], event['Y'], now)
+			self.publish(snitch=snitch)
+			self.snitch_tracker.seen(snitch)
+			self.invalidateAll()
+		else:
+			# standing still counts too, or its last velocity would carry on forever
+			self.snitch_tracker.stillAt(now)
+
+	def dropPickups(self, name, ids):
+		self.modify(name, drop=ids)
+		for pickup_id in ids:
+			self.logistics.pickupGone(pickup_id)
+
+	def grabbedPickup(self, name, index):
+		bot = bots[index]
+		if bot.state == Bot.PICKUP:
+			bot.request(Bot.changeState, Bot.CIRCLE)
+
+		to_delete_pickups = []
+		for p in getattr(self.view, name).values():
+			if math.hypot(bot.tank.x - p.x, bot.tank.y - p.y) < 10:
+				to_delete_pickups.append(p.id)
+
+		self.dropPickups(name, to_delete_pickups)
+		tank = bot.tank
+		self.logistics.tankChanged(index, tank.x, tank.y, tank.ammo, tank.health)
+
+	def onAmmoPickup(self, event, index):
+		logging.info("Grabbed ammo")
+		bots[index].tank.ammo = 10
+		self.grabbedPickup('ammo_pickups', index)
+
+	def onHealthPickup(self, event, index):
+		logging.info("Grabbed health")
+		self.grabbedPickup('health_pickups', index)
+
+	def onSnitchPickup(self, event, index):
+		carrier = self.view.enemies.get(event['Id'])
+		self.snitch_tracker.pickedUp(event['Id'], (carrier.x, carrier.y) if carrier else None)
+		self.assignCarrier()
+
+	def onEnteredGoal(self, event, index):
+		bots[index].request(Bot.changeState, Bot.CIRCLE)
+		bots[index].kill_counter = 0
+
+	def onGameTimeUpdate(self, event, index):
+		if 'Time' in event:
+			self.clock.observe(event['Time'], event.get('received', time.time()), index)
+
+	def onSnitchAppeared(self, event, index):
+		self.snitchAppears()
+
+	def onKill(self, event, index):
+		self.publish(enemies={})
+		bots[index].request(Bot.unhook)
+		bots[index].kill_counter += 1
+
+	def onHitDetected(self, event, index):
+		#bots[index].recover()
+		pass
+
+	def onDestroyed(self, event, index):
+		logging.info("Bot {} has died!".format(bots[index].name))
+		bots[index].reset()
+		self.team_grid.remove(index)
+		self.snitch_tracker.tankMoved(index, 0., 0., 0)
+		self.logistics.tankChanged(index, 0., 0., bots[index].tank.ammo, 0)
+		if self.snitch_owner is not None and id2bot_no.get(self.snitch_owner) == index:
+			self.snitch_tracker.dropped()
+		if self.snitch_owner is not None:
+			self.assignCarrier()
+
+		elif self.snitch:
+			self.snitchAppears()
+
 	def snitchAppears(self):
-		best_healthy_bots = sorted(bots, key=lambda x: x.health, reverse=True)
-		best_healthy_bots[0].changeState(Bot.SEEK_SNITCH)
-		best_healthy_bots[1].changeState(Bot.SEEK_SNITCH)
+		for tank_no in self.snitch_tracker.best():
+			bots[tank_no].request(Bot.changeState, Bot.SEEK_SNITCH)
 
 	def assignCarrier(self):
-		if self.snitch_owner in self.enemies:
-			carrier_data = self.enemies[self.snitch_owner]
-			seekers = sorted(bots, key=lambda x: math.hypot(x.X - carrier_data[0], x.Y - carrier_data[1]))
-			seekers[0].snitchSeeker(self.snitch_owner)
-			seekers[1].snitchSeeker(self.snitch_owner)
-		else:
-			carrier_bot = id2bot_no[self.snitch_owner]
-			bots[carrier_bot].goBanking()
+		carrier_id = self.snitch_owner
+		self.carrier_pending = False
+		if carrier_id in id2bot_no:
+			bots[id2bot_no[carrier_id]].request(Bot.goBanking)
+		elif carrier_id in self.view.enemies:
+			for tank_no in self.snitch_tracker.best():
+				bots[tank_no].request(Bot.snitchSeeker, carrier_id)
+		elif carrier_id is not None:
+			logging.info("Snitch taken by {} which we have not seen yet".format(carrier_id))
+			self.carrier_pending = True
 
 
 
@@ -520,8 +1350,25 @@ parser.add_argument('-d', '--debug', action='store_true', help='Enable debug out
 parser.add_argument('-H', '--hostname', default='127.0.0.1', help='Hostname to connect to')
 parser.add_argument('-p', '--port', default=8052, type=int, help='Port to connect to')
 parser.add_argument('-n', '--name', default=__file__[0:-3], help='Name of bot')
+parser.add_argument('-r', '--rate', default=20., type=float, help='Decision ticks per second for each tank')
+parser.add_argument('-c', '--conflate', action='store_true', help='Apply only the newest buffered update per object each tick')
+parser.add_argument('-s', '--split-io', action='store_true', help='Read each socket on its own thread, separate from decisions')
+parser.add_argument('--record-banking', metavar='FILE', help='Append every banking decision to FILE (see banking.py)')
+parser.add_argument('-P', '--processes', action='store_true', help='Run each tank in its own process, sharing observations through shared memory')
+parser.add_argument('-l', '--limit', action='append', default=[], metavar='NAME=RATE[:BURST]',
+	help="Cap each tank's commands per second, 'total' (default 40:10) or per message type (e.g. FIRE=5); repeatable")
+parser.add_argument('--record-latency', metavar='FILE', help='Append every command latency sample to FILE as JSON lines')
+parser.add_argument('--track-turns', action='store_true', help='Track enemies with a constant turn model instead of constant velocity')
+parser.add_argument('--trig-table', type=float, metavar='DEGREES', help='Use lookup-table trig at this resolution for heading maths')
 args = parser.parse_args()
 
+limits = None
+if args.limit:
+	limits = parseLimits(args.limit, {name: value for name, value in vars(ServerMessageTypes).items() if name.isupper()})
+
+if args.trig_table:
+	tools.use_trig_tables(args.trig_table)
+
 # Set up console logging
 if args.debug:
 	logging.basicConfig(format='[%(asctime)s] %(message)s', level=logging.DEBUG)
@@ -532,27 +1379,75 @@ else:
 # Connect to game server
 GameServer = ServerComms(args.hostname, args.port)
 
+def runTank(index, table):
+	'''
+	Body of a tank process: a Field of its own, fed by this tank's
+	connection and by the shared table, and local stand-ins for the
+	teammates that the other processes drive
+	'''
+	global field
+	field = Field(args.name, args.record_banking, args.record_latency, args.track_turns)
+	field.start()
+	shared = table.attach(index)
+	for i in range(4):
+		bots.append(Bot(args.hostname, args.port, args.name, i, args.rate, args.conflate, args.split_io,
+			shared=shared, connect=(i == index), limits=limits))
+	try:
+		bots[index].run()
+	finally:
+		bots[index].kill()
+		field.banking.close()
+		if field.latency_log:
+			field.latency_log.close()
+
+
 # Spawn our tanks
 logging.info("Creating tanks with name '{}'".format(args.name))
-field = Field(args.name)
-field.start()
-
+field = None
+table = None
+processes = []
 bots = []
 id2bot_no = {}
 
-for i in range(4):
-	bots.append(Bot(args.hostname, args.port, args.name, i))
+if args.processes:
+	table = SharedWorld.create(args.name)
+	# fork, so that the children inherit args and the module state without re-running it
+	context = multiprocessing.get_context('fork')
+	for i in range(4):
+		process = context.Process(target=runTank, args=(i, table), name="{}:{}".format(args.name, i))
+		process.daemon = True
+		processes.append(process)
+	for process in processes:
+		process.start()
+else:
+	field = Field(args.name, args.record_banking, args.record_latency, args.track_turns)
+	field.start()
 
-# Main loop - read game messages, ignore them and randomly perform actions
+	for i in range(4):
+		bots.append(Bot(args.hostname, args.port, args.name, i, args.rate, args.conflate, args.split_io, limits=limits))
 
-for bot in bots:
-	bot.start()
+	# Main loop - read game messages, ignore them and randomly perform actions
+
+	for bot in bots:
+		bot.start()
 
 
 def kill():
+	for process in processes:
+		process.terminate()
+	if table:
+		table.close()
+
 	for bot in bots:
 		bot.kill()
 
-	field.kill()
+	if field:
+		field.kill()
+		field.banking.close()
+		if field.latency_log:
+			field.latency_log.close()
+
+atexit.register(kill)
 
-atexit.register(kill)
\ No newline at end of file
+for process in processes:
+	process.join()
@@ -0,0 +1,99 @@
+'''
+Token buckets capping how many commands a tank sends to the server.
+
+A CommandLimiter has an optional bucket for all commands and optional
+buckets per message type; a command may only go out when every bucket it
+draws from holds a token. Buckets refill continuously at their rate up
+to their burst size, so short bursts pass while the long-run rate stays
+bounded. Commands that are held back wait in the connection's outbound
+queue, where a newer command of the same type can replace them.
+
+The limiter also counts what happened to commands, for reporting.
+'''
+
+import time
+from collections import Counter
+
+
+class TokenBucket(object):
+	__slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+	def __init__(self, rate, burst=None):
+		self.rate = float(rate)
+		self.burst = float(burst) if burst is not None else max(self.rate, 1.)
+		self.tokens = self.burst
+		self.stamp = time.time()
+
+	def refill(self, now):
+		self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+		self.stamp = now
+
+
+class CommandLimiter(object):
+	def __init__(self, limits=None):
+		'''
+		limits maps a message type, or None for all commands together, to
+		(rate per second, burst); a burst of None means one second's worth
+		'''
+		self.total = None
+		self.buckets = {}
+		for mtype, (rate, burst) in (limits or {}).items():
+			if mtype is None:
+				self.total = TokenBucket(rate, burst)
+			else:
+				self.buckets[mtype] = TokenBucket(rate, burst)
+		# per message type: commands sent, times one was held back for lack of
+		# tokens, replaced by a newer one while waiting, and dropped as stale
+		self.sent = Counter()
+		self.held = Counter()
+		self.merged = Counter()
+		self.dropped = Counter()
+
+	def allow(self, mtype, now):
+		'''
+		Whether a command of this type may be sent now; take() must follow
+		once it actually is
+		'''
+		for bucket in (self.total, self.buckets.get(mtype)):
+			if bucket is not None:
+				bucket.refill(now)
+				if bucket.tokens < 1.:
+					self.held[mtype] += 1
+					return False
+		return True
+
+	def take(self, mtype):
+		for bucket in (self.total, self.buckets.get(mtype)):
+			if bucket is not None:
+				bucket.tokens -= 1.
+		self.sent[mtype] += 1
+
+	def summary(self, names=None):
+		'''
+		One line of counters, with message types shown through names if given
+		'''
+		names = names or {}
+		parts = []
+		for label, counter in (('sent', self.sent), ('held', self.held), ('merged', self.merged), ('dropped', self.dropped)):
+			counts = ", ".join("{} {}".format(names.get(mtype, mtype), n) for mtype, n in sorted(counter.items()))
+			parts.append("{} {} ({})".format(label, sum(counter.values()), counts or "-"))
+		return "; ".join(parts)
+
+
+def parseLimits(specs, names):
+	'''
+	Limits from NAME=RATE[:BURST] strings, NAME being 'total' or a key of
+	names (message type name -> type)
+	'''
+	limits = {}
+	for spec in specs:
+		name, _, value = spec.partition('=')
+		rate, _, burst = value.partition(':')
+		if name == 'total':
+			mtype = None
+		elif name in names:
+			mtype = names[name]
+		else:
+			raise ValueError("Unknown message type {}".format(name))
+		limits[mtype] = (float(rate), float(burst) if burst else None)
+	return limits
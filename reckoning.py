@@ -0,0 +1,107 @@
+'''
+Dead reckoning of our own tanks between OBJECTUPDATEs.
+
+A PoseEstimator starts from the last reported state of a tank and plays
+forward what we last told it to do: turn towards the commanded heading
+at the turn rate we have observed, drive along its heading at the speed
+we have observed until the commanded distance is covered, and slew the
+turret towards its commanded heading. Every update replaces the starting
+point, so errors never accumulate beyond one update interval.
+
+Server headings run clockwise from the x axis (see Bot.moveTo), so a
+tank heading h moves along (cos h, -sin h).
+'''
+
+import math
+
+from tools import angle_diff
+from world import TankState
+
+
+def turn_towards(heading, target, max_turn):
+	'''
+	heading turned by at most max_turn degrees towards target, the short way round
+	'''
+	diff = (target - heading + 180.) % 360. - 180.
+	if abs(diff) <= max_turn:
+		return target % 360.
+	return (heading + math.copysign(max_turn, diff)) % 360.
+
+
+class PoseEstimator(object):
+	# starting guesses until they have been observed
+	SPEED = 10.
+	TURN_RATE = 90.
+	# how far ahead (seconds) of the last update a prediction may run
+	HORIZON = 0.5
+	# smoothing gain of the observed rates
+	GAIN = 0.2
+
+	def __init__(self):
+		self.speed = PoseEstimator.SPEED
+		self.turn_rate = PoseEstimator.TURN_RATE
+		self.forget()
+
+	def forget(self):
+		'''
+		Drop what refers to the current tank; the observed rates are kept
+		'''
+		self.base = None
+		self.heading_target = None
+		self.turret_target = None
+		# commanded distance not covered yet as of self.base
+		self.remaining = 0.
+
+	def commanded(self, kind, value):
+		'''
+		A command of this kind ('heading', 'move' or 'turret') went out;
+		value None for a turret that was set turning without a target
+		'''
+		if kind == 'heading':
+			self.heading_target = value
+		elif kind == 'move':
+			self.remaining = value
+		elif kind == 'turret':
+			self.turret_target = value
+
+	def observed(self, state):
+		old = self.base
+		self.base = state
+		if old is None or old.id != state.id:
+			return
+		dt = state.time - old.time
+		if not 0.01 < dt < 1.:
+			return
+		moved = math.hypot(state.x - old.x, state.y - old.y)
+		self.remaining = max(0., self.remaining - moved)
+		# only learn from updates where the tank was actually moving or turning
+		if moved / dt > 1.:
+			self.speed += PoseEstimator.GAIN * (moved / dt - self.speed)
+		turned = angle_diff(state.heading, old.heading) / dt
+		if turned > 1.:
+			self.turn_rate += PoseEstimator.GAIN * (turned - self.turn_rate)
+
+	def predict(self, now, turret_speed, seen=None):
+		'''
+		TankState for time now. seen is when the tank was last reported
+		where self.base has it, if that is later than the base's own time.
+		'''
+		base = self.base
+		if base is None:
+			return TankState()
+		start = max(base.time, seen or 0.)
+		dt = min(max(0., now - start), PoseEstimator.HORIZON)
+		heading = base.heading
+		x, y = base.x, base.y
+		if self.heading_target is not None:
+			heading = turn_towards(base.heading, self.heading_target, self.turn_rate * dt)
+		if self.remaining > 0.:
+			travel = min(self.speed * dt, self.remaining)
+			# drive along the heading halfway through the turn
+			mid = math.radians(turn_towards(base.heading, heading, self.turn_rate * dt / 2.))
+			x += travel * math.cos(mid)
+			y -= travel * math.sin(mid)
+		turret = base.turret_heading
+		if self.turret_target is not None:
+			turret = turn_towards(turret, self.turret_target, turret_speed * dt)
+		return TankState(base.id, x, y, heading, turret, base.health, base.ammo, now)
@@ -0,0 +1,223 @@
+'''
+World state shared between tank processes through shared memory.
+
+The table is split into one partition per tank process. Each process
+only writes rows in its own partition, so every row has a single writer
+and a seqlock is enough to make reads consistent: the writer bumps the
+row's sequence number to odd, writes, then bumps it to even, and a
+reader retries if it saw an odd number or the number changed while it
+copied the row. No process ever takes a lock. A reader gives up on a row
+that stays odd, in case its writer died halfway through.
+
+Rows hold the last OBJECTUPDATE a process received for an object. Every
+other message (kills, pickups, deaths, the snitch) goes into a ring of
+event rows after the object rows, numbered so that readers can tell
+which they have not merged yet. Either way the other processes feed them
+through their own Field as if they had arrived on their own socket, so
+every Field sees what the single Field of the threaded mode would.
+'''
+
+import time
+from multiprocessing import shared_memory
+
+
+class SharedWorld(object):
+	# seq, id, kind, tank_no, x, y, heading, turret_heading, health, ammo,
+	# time (local, when the server reported it, as the publisher's Field saw it)
+	COLUMNS = 11
+	SEQ, ID, KIND, TANK_NO, X, Y, HEADING, TURRET_HEADING, HEALTH, AMMO, TIME = range(COLUMNS)
+	ROW_BYTES = COLUMNS * 8
+	# seq, count (1 for the partition's first event), messageType, Id (-1 if none)
+	EVENT_COLUMNS = 4
+	EVENT_COUNT, EVENT_TYPE, EVENT_ID = range(1, EVENT_COLUMNS)
+	# event rows per partition; a reader this many events behind loses some
+	EVENTS = 32
+	# times a reader re-reads a row that is being written before giving up on it
+	READ_RETRIES = 1000
+	OBJECTUPDATE = 18
+
+	ENEMY, TEAMMATE, AMMO_PICKUP, HEALTH_PICKUP, SNITCH = range(1, 6)
+	KINDS = {'AmmoPickup': AMMO_PICKUP, 'HealthPickup': HEALTH_PICKUP, 'Snitch': SNITCH}
+	TYPES = {AMMO_PICKUP: 'AmmoPickup', HEALTH_PICKUP: 'HealthPickup', SNITCH: 'Snitch'}
+
+	def __init__(self, shm, partitions, slots, owner, team_name, cells=None, created=False):
+		self.shm = shm
+		# one view of the buffer for every SharedWorld on it, so close() can release it
+		self.cells = cells if cells is not None else shm.buf.cast('d')
+		self.partitions = partitions
+		self.slots = slots
+		self.owner = owner
+		self.team_name = team_name
+		self.created = created
+		# object Id -> row in our own partition
+		self.rows = {}
+		# row -> sequence number we last merged, for the other partitions
+		self.merged = {}
+		# events written to our own partition so far
+		self.events = 0
+		# partition -> count of the next event of it we have not merged
+		self.next_event = {partition: 1 for partition in range(partitions)}
+		# first cell of the event rings
+		self.event_base = partitions * slots * self.COLUMNS
+
+	@classmethod
+	def create(cls, team_name, partitions=4, slots=64):
+		size = partitions * (slots * cls.ROW_BYTES + cls.EVENTS * cls.EVENT_COLUMNS * 8)
+		shm = shared_memory.SharedMemory(create=True, size=size)
+		shm.buf[:] = bytes(len(shm.buf))
+		return cls(shm, partitions, slots, None, team_name, created=True)
+
+	def attach(self, owner):
+		'''
+		View of the same table for the process owning partition owner.
+		Meant to be called in the child after fork.
+		'''
+		return SharedWorld(self.shm, self.partitions, self.slots, owner, self.team_name, self.cells)
+
+	def close(self):
+		self.cells.release()
+		self.shm.close()
+		if self.created:
+			self.shm.unlink()
+
+	def rowFor(self, elem_id):
+		row = self.rows.get(elem_id)
+		if row is not None:
+			return row
+		base = self.owner * self.slots
+		if len(self.rows) < self.slots:
+			row = base + len(self.rows)
+		else:
+			# full: reuse the row observed longest ago
+			row = min(self.rows.values(), key=lambda r: self.cells[r * self.COLUMNS + self.TIME])
+			self.rows = {i: r for i, r in self.rows.items() if r != row}
+		self.rows[elem_id] = row
+		return row
+
+	def publish(self, event, observed=None):
+		'''
+		Write a message received on our own socket into our partition;
+		observed is when an OBJECTUPDATE describes, now if not given
+		'''
+		if event['messageType'] != self.OBJECTUPDATE:
+			self.publishEvent(event)
+			return
+		if event['Type'] == 'Tank':
+			if event['Name'].startswith(self.team_name):
+				kind, tank_no = self.TEAMMATE, int(event['Name'][-1])
+			else:
+				kind, tank_no = self.ENEMY, -1
+		else:
+			kind, tank_no = self.KINDS.get(event['Type'], 0), -1
+			if not kind:
+				return
+		cells = self.cells
+		start = self.rowFor(event['Id']) * self.COLUMNS
+		seq = cells[start + self.SEQ]
+		cells[start + self.SEQ] = seq + 1
+		cells[start + self.ID] = event['Id']
+		cells[start + self.KIND] = kind
+		cells[start + self.TANK_NO] = tank_no
+		cells[start + self.X] = event['X']
+		cells[start + self.Y] = event['Y']
+		cells[start + self.HEADING] = event.get('Heading', 0.)
+		cells[start + self.TURRET_HEADING] = event.get('TurretHeading', 0.)
+		cells[start + self.HEALTH] = event.get('Health', 0.)
+		cells[start + self.AMMO] = event.get('Ammo', 0.)
+		cells[start + self.TIME] = observed if observed is not None else time.time()
+		cells[start + self.SEQ] = seq + 2
+
+	def publishEvent(self, event):
+		self.events += 1
+		cells = self.cells
+		start = self.eventStart(self.owner, self.events)
+		seq = cells[start + self.SEQ]
+		cells[start + self.SEQ] = seq + 1
+		cells[start + self.EVENT_COUNT] = self.events
+		cells[start + self.EVENT_TYPE] = event['messageType']
+		cells[start + self.EVENT_ID] = event.get('Id', -1)
+		cells[start + self.SEQ] = seq + 2
+
+	def eventStart(self, partition, count):
+		return self.event_base + (partition * self.EVENTS + count % self.EVENTS) * self.EVENT_COLUMNS
+
+	def readCells(self, start, width):
+		'''
+		Consistent copy of the width cells of the row at start, or None if
+		it has never been written or stayed half-written for too long
+		'''
+		cells = self.cells
+		for _ in range(self.READ_RETRIES):
+			seq = cells[start + self.SEQ]
+			if seq == 0:
+				return None
+			if int(seq) % 2:
+				continue
+			values = cells[start:start + width].tolist()
+			if cells[start + self.SEQ] == seq:
+				return values
+		return None
+
+	def readRow(self, row):
+		return self.readCells(row * self.COLUMNS, self.COLUMNS)
+
+	def toEvent(self, values):
+		kind = values[self.KIND]
+		event = {'messageType': self.OBJECTUPDATE, 'Id': int(values[self.ID]), 'X': values[self.X], 'Y': values[self.Y],
+			'observed': values[self.TIME]}
+		if kind in (self.ENEMY, self.TEAMMATE):
+			event['Type'] = 'Tank'
+			event['Name'] = "{}:{}".format(self.team_name, int(values[self.TANK_NO])) if kind == self.TEAMMATE else '?'
+			event['Heading'] = values[self.HEADING]
+			event['TurretHeading'] = values[self.TURRET_HEADING]
+			event['Health'] = int(values[self.HEALTH])
+			event['Ammo'] = int(values[self.AMMO])
+		else:
+			event['Type'] = self.TYPES[kind]
+		return event
+
+	def newEvents(self, partition):
+		'''
+		Messages of a partition we have not merged yet, oldest first
+		'''
+		found = []
+		while True:
+			count = self.next_event[partition]
+			values = self.readCells(self.eventStart(partition, count), self.EVENT_COLUMNS)
+			if values is None or values[self.EVENT_COUNT] < count:
+				return found
+			if values[self.EVENT_COUNT] > count:
+				# overwritten before we got to it: resume from the oldest one left
+				self.next_event[partition] = int(values[self.EVENT_COUNT]) - self.EVENTS + 1
+				continue
+			event = {'messageType': int(values[self.EVENT_TYPE])}
+			if values[self.EVENT_ID] >= 0:
+				event['Id'] = int(values[self.EVENT_ID])
+			found.append(event)
+			self.next_event[partition] = count + 1
+
+	def changes(self):
+		'''
+		(partition, message) for every row other processes wrote since the
+		last call: object updates first, then events in the order they came
+		'''
+		found = []
+		for partition in range(self.partitions):
+			if partition == self.owner:
+				continue
+			for row in range(partition * self.slots, (partition + 1) * self.slots):
+				seq = self.cells[row * self.COLUMNS + self.SEQ]
+				if seq == 0:
+					# partitions fill from the start, nothing further in this one
+					break
+				if self.merged.get(row) == seq:
+					continue
+				values = self.readRow(row)
+				if values is None:
+					continue
+				self.merged[row] = values[self.SEQ]
+				found.append((partition, self.toEvent(values)))
+		for partition in range(self.partitions):
+			if partition != self.owner:
+				found.extend((partition, event) for event in self.newEvents(partition))
+		return found
@@ -0,0 +1,133 @@
+'''
+Snitch bookkeeping: where it has been, who carries it and which of our
+tanks are best placed to go after it.
+
+The ranking of interceptors is kept up to date as tank and target
+positions arrive, so the SNITCHAPPEARED / SNITCHPICKUP / DESTROYED
+handlers only read its head.
+'''
+
+import bisect
+import math
+from collections import deque
+from threading import Lock
+
+
+class SnitchTracker(object):
+	# its velocity is measured over this many seconds of sightings
+	VELOCITY_WINDOW = 0.5
+	# how far ahead (seconds) of the last sighting a prediction may run
+	HORIZON = 1.
+	# a loose snitch not reported for this many seconds is no longer predicted
+	GONE_AFTER = 5.
+
+	def __init__(self, history=50):
+		self.history = deque(maxlen=history)
+		# Id of the tank carrying the snitch, ours or an enemy; None while it is loose
+		self.carrier = None
+		self.target = None
+		self.tanks = {}
+		# sorted (score, tank_no), replaced rather than modified so best() needs no lock
+		self.ranking = ()
+		self.lock = Lock()
+
+	def score(self, x, y, health):
+		if health <= 0:
+			return float('inf')
+		if self.target is None:
+			# nothing to chase yet: prefer the healthiest tanks
+			return -health
+		return math.hypot(x - self.target[0], y - self.target[1])
+
+	def rerank(self, tank_no):
+		'''
+		Move one tank to its new place in the ranking; called with the lock held
+		'''
+		ranking = list(self.ranking)
+		for i, (_, no) in enumerate(ranking):
+			if no == tank_no:
+				del ranking[i]
+				break
+		x, y, health = self.tanks[tank_no]
+		bisect.insort(ranking, (self.score(x, y, health), tank_no))
+		self.ranking = tuple(ranking)
+
+	def retarget(self, x, y):
+		'''
+		The point we chase moved: every score changes; called with the lock held
+		'''
+		self.target = (x, y)
+		self.ranking = tuple(sorted((self.score(tx, ty, h), no) for no, (tx, ty, h) in self.tanks.items()))
+
+	def tankMoved(self, tank_no, x, y, health):
+		with self.lock:
+			self.tanks[tank_no] = (x, y, health)
+			self.rerank(tank_no)
+
+	def seen(self, snitch):
+		with self.lock:
+			self.history.append((snitch.x, snitch.y, snitch.time))
+			if self.carrier is None:
+				self.retarget(snitch.x, snitch.y)
+
+	def stillAt(self, t):
+		'''
+		The snitch was reported at time t where it was last seen
+		'''
+		with self.lock:
+			if self.history and t > self.history[-1][2]:
+				x, y, _ = self.history[-1]
+				self.history.append((x, y, t))
+
+	def carrierMoved(self, enemy):
+		with self.lock:
+			if enemy.id == self.carrier:
+				self.retarget(enemy.x, enemy.y)
+
+	def pickedUp(self, carrier_id, position=None):
+		with self.lock:
+			self.carrier = carrier_id
+			if position:
+				self.retarget(*position)
+
+	def dropped(self):
+		with self.lock:
+			self.carrier = None
+			if self.history:
+				self.retarget(*self.history[-1][:2])
+
+	def best(self, n=2):
+		'''
+		Our n best placed live tanks, best first
+		'''
+		return [no for score, no in self.ranking[:n] if score != float('inf')]
+
+	def velocity(self):
+		'''
+		Snitch velocity (units/s) over the last VELOCITY_WINDOW seconds of
+		sightings; called with the lock held
+		'''
+		if len(self.history) < 2:
+			return 0., 0.
+		x1, y1, t1 = self.history[-1]
+		for x0, y0, t0 in self.history:
+			if t1 - t0 <= SnitchTracker.VELOCITY_WINDOW:
+				break
+		if t1 <= t0:
+			return 0., 0.
+		return (x1 - x0) / (t1 - t0), (y1 - y0) / (t1 - t0)
+
+	def predict(self, t):
+		'''
+		Where the loose snitch should be at time t, or None if we have never
+		seen it, it is carried or it has not been reported for GONE_AFTER seconds
+		'''
+		with self.lock:
+			if not self.history or self.carrier is not None:
+				return None
+			x, y, seen = self.history[-1]
+			if t - seen > SnitchTracker.GONE_AFTER:
+				return None
+			vx, vy = self.velocity()
+		dt = min(max(0., t - seen), SnitchTracker.HORIZON)
+		return x + vx * dt, y + vy * dt
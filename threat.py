@@ -0,0 +1,114 @@
+'''
+Decaying raster of how exposed each part of the arena is to enemy fire.
+
+Every observation of an enemy stamps its turret cone onto the grid,
+weighted by how long it has been aiming that way. Old stamps fade with
+an exponential half life. Stamps are precomputed per heading bucket, and
+decay is applied lazily through a global scale factor, so an update costs
+one pass over a precomputed cone and a query is a single lookup.
+'''
+
+import math
+import time
+from threading import Lock
+
+
+class ThreatMap(object):
+	# arena bounds, goals sit at (0, +-100)
+	MIN_X, MAX_X = -70., 70.
+	MIN_Y, MAX_Y = -100., 100.
+	# rebase the stored values once their scale factor reaches e**this
+	RENORMALISE_AT = 14.
+
+	def __init__(self, cell_size=5., fire_range=70., cone=20., half_life=2., heading_step=5.):
+		self.cell_size = cell_size
+		self.cols = int(math.ceil((ThreatMap.MAX_X - ThreatMap.MIN_X) / cell_size))
+		self.rows = int(math.ceil((ThreatMap.MAX_Y - ThreatMap.MIN_Y) / cell_size))
+		self.decay_rate = math.log(2) / half_life
+		self.heading_step = heading_step
+		self.stencils = [self.buildStencil(i * heading_step, fire_range, cone)
+			for i in range(int(round(360 / heading_step)))]
+		# (values, t0): stored values are scaled by exp(decay_rate * (t - t0)),
+		# replaced as a whole on renormalisation so readers never see a mix
+		self.grid = ([0.] * (self.cols * self.rows), time.time())
+		self.last_seen = {}
+		self.write_lock = Lock()
+
+	def buildStencil(self, heading, fire_range, cone):
+		'''
+		(dcol, drow, weight) for cells inside a cone along heading, weight
+		falling off linearly with distance
+		'''
+		stencil = []
+		reach = int(math.ceil(fire_range / self.cell_size))
+		for dc in range(-reach, reach + 1):
+			for dr in range(-reach, reach + 1):
+				dx, dy = dc * self.cell_size, dr * self.cell_size
+				dist = math.hypot(dx, dy)
+				if dist > fire_range:
+					continue
+				if dist > 0:
+					off = (math.degrees(math.atan2(dy, dx)) - heading) % 360
+					if min(off, 360 - off) > cone:
+						continue
+				stencil.append((dc, dr, 1. - dist / fire_range))
+		return stencil
+
+	def cellOf(self, x, y):
+		col = int((x - ThreatMap.MIN_X) / self.cell_size)
+		row = int((y - ThreatMap.MIN_Y) / self.cell_size)
+		return min(max(col, 0), self.cols - 1), min(max(row, 0), self.rows - 1)
+
+	def observe(self, enemy, now=None):
+		'''
+		Stamp an enemy's turret cone, weighted by the time since we last saw it
+		'''
+		now = now if now is not None else enemy.time
+		with self.write_lock:
+			last = self.last_seen.get(enemy.id)
+			self.last_seen[enemy.id] = now
+			if enemy.ammo == 0:
+				return
+			weight = 0.1 if last is None else min(max(now - last, 0.), 1.)
+			values, t0 = self.grid
+			exponent = self.decay_rate * (now - t0)
+			if exponent > ThreatMap.RENORMALISE_AT:
+				shrink = math.exp(-exponent)
+				values = [v * shrink for v in values]
+				t0, exponent = now, 0.
+				self.grid = (values, t0)
+			weight *= math.exp(exponent)
+
+			# the server's headings run the other way round from atan2
+			heading = (-enemy.turret_heading) % 360
+			stencil = self.stencils[int(round(heading / self.heading_step)) % len(self.stencils)]
+			col, row = self.cellOf(enemy.x, enemy.y)
+			cols, rows = self.cols, self.rows
+			for dc, dr, w in stencil:
+				c, r = col + dc, row + dr
+				if 0 <= c < cols and 0 <= r < rows:
+					values[r * cols + c] += w * weight
+
+	def forget(self, enemy_id):
+		with self.write_lock:
+			self.last_seen.pop(enemy_id, None)
+
+	def danger(self, x, y, now=None):
+		values, t0 = self.grid
+		now = now if now is not None else time.time()
+		col, row = self.cellOf(x, y)
+		return values[row * self.cols + col] * math.exp(-self.decay_rate * (now - t0))
+
+	def safest(self, points):
+		'''
+		Lowest-danger point of a list of (x, y), ties going to the earliest
+		'''
+		values = self.grid[0]
+		cols = self.cols
+		best, best_value = None, None
+		for p in points:
+			col, row = self.cellOf(p[0], p[1])
+			v = values[row * cols + col]
+			if best_value is None or v < best_value:
+				best, best_value = p, v
+		return best
@@ -6,10 +6,119 @@ def rad2deg(x):
 def deg2rad(x):
     return x * math.pi / 180
 
+
+class MathTrig(object):
+    '''
+    Trig in degrees on top of the math module
+    '''
+    K = math.pi / 180
+
+    def sin(self, deg):
+        return math.sin(deg * self.K)
+
+    def cos(self, deg):
+        return math.cos(deg * self.K)
+
+    def atan2(self, y, x):
+        return math.atan2(y, x) / self.K
+
+
+class TableTrig(object):
+    '''
+    Trig in degrees from precomputed tables with linear interpolation.
+
+    sin/cos are tabulated every `resolution` degrees (error below
+    resolution**2 * 4e-5, i.e. ~2.5e-6 at 0.25 degrees). atan2 folds the
+    angle into the first octant and interpolates a table of atan over
+    [0, 1] with `atan_steps` entries; its error is bounded by about
+    5 / atan_steps**2 degrees.
+
+    In CPython the interpreted lookup is slower than the math module's C
+    calls (run this module for numbers), so MathTrig stays the default.
+    '''
+
+    def __init__(self, resolution=0.25, atan_steps=256):
+        self.resolution = resolution
+        self.steps = int(round(360 / resolution))
+        self.scale = self.steps / 360.
+        self.sin_table = [math.sin(2 * math.pi * i / self.steps) for i in range(self.steps + 2)]
+        self.atan_steps = atan_steps
+        self.atan_table = [math.degrees(math.atan(i / atan_steps)) for i in range(atan_steps + 1)]
+
+    def sin(self, deg):
+        pos = (deg % 360) * self.scale
+        i = int(pos)
+        lo = self.sin_table[i]
+        return lo + (self.sin_table[i + 1] - lo) * (pos - i)
+
+    def cos(self, deg):
+        return self.sin(deg + 90)
+
+    def atan2(self, y, x):
+        ax, ay = abs(x), abs(y)
+        if ax == 0 and ay == 0:
+            return 0.
+        if ay <= ax:
+            pos = ay / ax * self.atan_steps
+            i = int(pos)
+            lo = self.atan_table[i]
+            angle = lo + (self.atan_table[min(i + 1, self.atan_steps)] - lo) * (pos - i)
+        else:
+            pos = ax / ay * self.atan_steps
+            i = int(pos)
+            lo = self.atan_table[i]
+            angle = 90. - (lo + (self.atan_table[min(i + 1, self.atan_steps)] - lo) * (pos - i))
+        if x < 0:
+            angle = 180. - angle
+        if y < 0:
+            angle = -angle
+        return angle
+
+
+# the backend heading maths goes through; see use_trig_tables()
+trig = MathTrig()
+
+def use_trig_tables(resolution=0.25, atan_steps=256):
+    global trig
+    trig = TableTrig(resolution, atan_steps)
+
+def use_math_trig():
+    global trig
+    trig = MathTrig()
+
+
 def rotate_head(cur_x, cur_y, dest_x, dest_y):
-    heading = math.atan2(dest_y - cur_y, dest_x - cur_x)
-    heading = (rad2deg(heading) - 360) % 360
+    heading = trig.atan2(dest_y - cur_y, dest_x - cur_x)
+    heading = (heading - 360) % 360
     return math.fabs(heading)
 
 def distance(cur_x, cur_y, dest_x, dest_y):
-    return math.hypot(cur_x - dest_x, cur_y - dest_y)
\ No newline at end of file
+    return math.hypot(cur_x - dest_x, cur_y - dest_y)
+
+
+def angle_diff(a, b):
+    d = (a - b) % 360
+    return min(d, 360 - d)
+
+
+if __name__ == '__main__':
+    import random
+    import timeit
+
+    exact = MathTrig()
+    angles = [random.uniform(-720, 720) for _ in range(20000)]
+    points = [(random.uniform(-100, 100), random.uniform(-100, 100)) for _ in range(20000)]
+
+    for resolution, atan_steps in ((1., 64), (0.25, 256), (0.1, 1024)):
+        table = TableTrig(resolution, atan_steps)
+        sin_err = max(abs(table.sin(a) - exact.sin(a)) for a in angles)
+        cos_err = max(abs(table.cos(a) - exact.cos(a)) for a in angles)
+        atan_err = max(angle_diff(table.atan2(y, x), exact.atan2(y, x)) for x, y in points)
+        print("table res={} atan_steps={}: max sin err {:.2e}, cos err {:.2e}, atan2 err {:.2e} deg".format(
+            resolution, atan_steps, sin_err, cos_err, atan_err))
+
+    table = TableTrig()
+    for name, backend in (('math', exact), ('table', table)):
+        t_sin = timeit.timeit(lambda: [backend.sin(a) for a in angles], number=10) / (10 * len(angles))
+        t_atan = timeit.timeit(lambda: [backend.atan2(y, x) for x, y in points], number=10) / (10 * len(points))
+        print("{:5s}: sin {:.0f}ns, atan2 {:.0f}ns".format(name, t_sin * 1e9, t_atan * 1e9))
@@ -0,0 +1,236 @@
+'''
+Kalman filter tracking of enemy tanks.
+
+Each enemy gets a track with state (x, y, vx, vy) and its covariance. The
+motion model is constant velocity, or optionally constant turn, with the
+turn rate read off the enemy's reported headings. Observations from all
+our connections are queued and folded in together: every round predicts
+all the tracks that have an observation to the time of that observation
+and updates them at once, as array operations over all tracks. A track
+is never dropped for being old; its uncertainty just keeps growing until
+lost() gives it up.
+
+Needs NumPy; without it available() is False and callers keep using raw
+observations.
+'''
+
+from threading import Lock
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+def available():
+	return np is not None
+
+
+class Estimate(object):
+	'''
+	Where a track is believed to be at time, with the standard deviation
+	of that position
+	'''
+	__slots__ = ('id', 'x', 'y', 'vx', 'vy', 'sigma', 'time')
+
+	def __init__(self, id, x, y, vx, vy, sigma, time):
+		self.id = id
+		self.x = x
+		self.y = y
+		self.vx = vx
+		self.vy = vy
+		self.sigma = sigma
+		self.time = time
+
+	def __repr__(self):
+		return "Estimate({}, ({:.1f}, {:.1f}) +-{:.1f}, v=({:.1f}, {:.1f}))".format(
+			self.id, self.x, self.y, self.sigma, self.vx, self.vy)
+
+
+class EnemyTracker(object):
+	# standard deviation of a reported position
+	OBSERVATION_SIGMA = 0.5
+	# standard deviation of the speed of a track we know nothing about yet
+	VELOCITY_SIGMA = 10.
+	# white noise acceleration, (units/s^2)^2 per second
+	ACCELERATION_NOISE = 25.
+	# smoothing gain of the turn rate read off headings
+	TURN_GAIN = 0.3
+	# an observation further than this many standard deviations from its track restarts it (respawns)
+	GATE = 10.
+
+	def __init__(self, turn=False, capacity=16):
+		self.turn = turn
+		self.ids = {}
+		self.free = []
+		self.pending = []
+		self.lock = Lock()
+		self.allocate(capacity)
+
+	def allocate(self, capacity):
+		self.state = np.zeros((capacity, 4))
+		self.covariance = np.zeros((capacity, 4, 4))
+		# time state and covariance refer to
+		self.time = np.zeros(capacity)
+		# turn rate in radians per second, anticlockwise; always 0 without turn
+		self.omega = np.zeros(capacity)
+		# last reported heading and its time, for the turn rate
+		self.heading = np.zeros(capacity)
+		self.heading_time = np.zeros(capacity)
+		self.free = list(range(capacity - 1, -1, -1))
+
+	def grow(self):
+		old = len(self.time)
+		arrays = (self.state, self.covariance, self.time, self.omega, self.heading, self.heading_time)
+		self.allocate(old * 2)
+		for new, current in zip((self.state, self.covariance, self.time, self.omega, self.heading, self.heading_time), arrays):
+			new[:old] = current
+		self.free = list(range(old * 2 - 1, old - 1, -1))
+
+	def observe(self, track_id, x, y, heading, t):
+		with self.lock:
+			row = self.ids.get(track_id)
+			if row is None:
+				self.start(track_id, x, y, heading, t)
+			else:
+				self.pending.append((t, row, x, y, heading))
+
+	def start(self, track_id, x, y, heading, t, row=None):
+		if row is None:
+			if not self.free:
+				self.grow()
+			row = self.free.pop()
+			self.ids[track_id] = row
+		self.state[row] = (x, y, 0., 0.)
+		r = EnemyTracker.OBSERVATION_SIGMA ** 2
+		v = EnemyTracker.VELOCITY_SIGMA ** 2
+		self.covariance[row] = np.diag((r, r, v, v))
+		self.time[row] = t
+		self.omega[row] = 0.
+		self.heading[row] = heading
+		self.heading_time[row] = t
+
+	def forget(self, track_id):
+		with self.lock:
+			row = self.ids.pop(track_id, None)
+			if row is not None:
+				self.free.append(row)
+				self.pending = [obs for obs in self.pending if obs[1] != row]
+
+	def flush(self):
+		'''
+		Fold in every queued observation; called with the lock held
+		'''
+		pending = sorted(self.pending)
+		self.pending = []
+		while pending:
+			# at most one observation per track per round, oldest first
+			batch = {}
+			rest = []
+			for obs in pending:
+				if obs[1] in batch:
+					rest.append(obs)
+				else:
+					batch[obs[1]] = obs
+			self.updateBatch(np.array([obs[1] for obs in batch.values()]),
+				np.array([[obs[0], obs[2], obs[3], obs[4]] for obs in batch.values()]))
+			pending = rest
+
+	def transition(self, dt, omega):
+		'''
+		Per-track state transition matrices and process noise for dt seconds
+		'''
+		n = len(dt)
+		F = np.tile(np.eye(4), (n, 1, 1))
+		wt = omega * dt
+		turning = np.abs(omega) > 1e-6
+		safe = np.where(turning, omega, 1.)
+		sin_wt, cos_wt = np.sin(wt), np.cos(wt)
+		a = np.where(turning, sin_wt / safe, dt)
+		b = np.where(turning, (1. - cos_wt) / safe, 0.)
+		F[:, 0, 2] = a
+		F[:, 0, 3] = -b
+		F[:, 1, 2] = b
+		F[:, 1, 3] = a
+		F[:, 2, 2] = cos_wt
+		F[:, 2, 3] = -sin_wt
+		F[:, 3, 2] = sin_wt
+		F[:, 3, 3] = cos_wt
+
+		q = EnemyTracker.ACCELERATION_NOISE
+		Q = np.zeros((n, 4, 4))
+		pp, pv, vv = q * dt ** 3 / 3., q * dt ** 2 / 2., q * dt
+		for p, v in ((0, 2), (1, 3)):
+			Q[:, p, p] = pp
+			Q[:, p, v] = pv
+			Q[:, v, p] = pv
+			Q[:, v, v] = vv
+		return F, Q
+
+	def predicted(self, rows, t):
+		'''
+		(state, covariance) of rows at times t, without changing the tracks
+		'''
+		dt = np.maximum(t - self.time[rows], 0.)
+		F, Q = self.transition(dt, self.omega[rows])
+		state = np.einsum('nij,nj->ni', F, self.state[rows])
+		covariance = F @ self.covariance[rows] @ F.transpose(0, 2, 1) + Q
+		return state, covariance
+
+	def updateBatch(self, rows, observations):
+		t, z, heading = observations[:, 0], observations[:, 1:3], observations[:, 3]
+		if self.turn:
+			dt = t - self.heading_time[rows]
+			ok = dt > 0.01
+			# server headings run clockwise
+			turned = -np.radians((heading - self.heading[rows] + 180.) % 360. - 180.)
+			rate = np.where(ok, turned / np.where(ok, dt, 1.), self.omega[rows])
+			self.omega[rows] += EnemyTracker.TURN_GAIN * (rate - self.omega[rows])
+		self.heading[rows] = heading
+		self.heading_time[rows] = t
+
+		state, covariance = self.predicted(rows, t)
+		innovation = z - state[:, :2]
+		S = covariance[:, :2, :2] + np.eye(2) * EnemyTracker.OBSERVATION_SIGMA ** 2
+		det = S[:, 0, 0] * S[:, 1, 1] - S[:, 0, 1] * S[:, 1, 0]
+		S_inv = np.empty_like(S)
+		S_inv[:, 0, 0] = S[:, 1, 1] / det
+		S_inv[:, 1, 1] = S[:, 0, 0] / det
+		S_inv[:, 0, 1] = -S[:, 0, 1] / det
+		S_inv[:, 1, 0] = -S[:, 1, 0] / det
+		K = covariance[:, :, :2] @ S_inv
+		state += np.einsum('nij,nj->ni', K, innovation)
+		covariance -= K @ covariance[:, :2, :]
+		covariance = (covariance + covariance.transpose(0, 2, 1)) / 2.
+
+		self.state[rows] = state
+		self.covariance[rows] = covariance
+		self.time[rows] = t
+
+		distance2 = np.einsum('ni,nij,nj->n', innovation, S_inv, innovation)
+		for i in np.nonzero(distance2 > EnemyTracker.GATE ** 2)[0]:
+			self.start(None, z[i, 0], z[i, 1], heading[i], t[i], row=rows[i])
+
+	def estimates(self, t, ids=None):
+		'''
+		{id: Estimate} at time t for the given tracks, all by default
+		'''
+		with self.lock:
+			self.flush()
+			ids = [i for i in (self.ids if ids is None else ids) if i in self.ids]
+			if not ids:
+				return {}
+			rows = np.array([self.ids[i] for i in ids])
+			state, covariance = self.predicted(rows, np.full(len(rows), t))
+		sigma = np.sqrt(np.maximum(covariance[:, 0, 0] + covariance[:, 1, 1], 0.))
+		return {track_id: Estimate(track_id, s[0], s[1], s[2], s[3], sg, t)
+			for track_id, s, sg in zip(ids, state.tolist(), sigma.tolist())}
+
+	def estimate(self, track_id, t):
+		return self.estimates(t, (track_id,)).get(track_id)
+
+	def lost(self, t, max_sigma):
+		'''
+		Ids of the tracks whose position is more uncertain than max_sigma by time t
+		'''
+		return [e.id for e in self.estimates(t).values() if e.sigma > max_sigma]
@@ -0,0 +1,117 @@
+'''
+Record types for everything the Field knows about the arena.
+
+All of them use __slots__: there are many of them, they are created for
+every OBJECTUPDATE and they are read in the bots' hot loops.
+'''
+
+from types import MappingProxyType
+
+
+def frozen(items):
+	'''
+	Read-only view of a dict that the caller promises never to touch again
+	'''
+	if isinstance(items, MappingProxyType):
+		return items
+	return MappingProxyType(items if items is not None else {})
+
+
+class Point(object):
+	__slots__ = ('x', 'y')
+
+	def __init__(self, x, y):
+		self.x = x
+		self.y = y
+
+	def __repr__(self):
+		return "Point(x={}, y={})".format(self.x, self.y)
+
+
+class EnemyState(object):
+	__slots__ = ('id', 'x', 'y', 'time', 'heading', 'turret_heading', 'health', 'ammo')
+
+	def __init__(self, id, x, y, time, heading=0., turret_heading=0., health=3, ammo=10):
+		self.id = id
+		self.x = x
+		self.y = y
+		self.time = time
+		self.heading = heading
+		self.turret_heading = turret_heading
+		self.health = health
+		self.ammo = ammo
+
+	def __repr__(self):
+		return "EnemyState(id={}, x={}, y={}, heading={}, health={})".format(
+			self.id, self.x, self.y, self.heading, self.health)
+
+
+class Pickup(object):
+	__slots__ = ('id', 'x', 'y', 'time')
+
+	def __init__(self, id, x, y, time):
+		self.id = id
+		self.x = x
+		self.y = y
+		self.time = time
+
+	def __repr__(self):
+		return "Pickup(id={}, x={}, y={})".format(self.id, self.x, self.y)
+
+
+class Snitch(object):
+	__slots__ = ('id', 'x', 'y', 'time')
+
+	def __init__(self, id, x, y, time):
+		self.id = id
+		self.x = x
+		self.y = y
+		self.time = time
+
+	def __repr__(self):
+		return "Snitch(id={}, x={}, y={})".format(self.id, self.x, self.y)
+
+
+class TankState(object):
+	'''
+	Last known state of one of our own tanks
+	'''
+	__slots__ = ('id', 'x', 'y', 'heading', 'turret_heading', 'health', 'ammo', 'time')
+
+	def __init__(self, id=None, x=0., y=0., heading=0., turret_heading=0., health=3, ammo=10, time=0.):
+		self.id = id
+		self.x = x
+		self.y = y
+		self.heading = heading
+		self.turret_heading = turret_heading
+		self.health = health
+		self.ammo = ammo
+		self.time = time
+
+	def __repr__(self):
+		return "TankState(id={}, x={}, y={}, heading={}, health={}, ammo={})".format(
+			self.id, self.x, self.y, self.heading, self.health, self.ammo)
+
+
+class WorldView(object):
+	'''
+	Immutable snapshot of the Field.
+
+	Writers never modify a published view: they build a new one with
+	replace() and swap the Field's reference, so a reader holding a view
+	always sees a consistent world without taking any lock.
+	'''
+	__slots__ = ('version', 'enemies', 'ammo_pickups', 'health_pickups', 'snitch')
+
+	def __init__(self, version=0, enemies=None, ammo_pickups=None, health_pickups=None, snitch=None):
+		self.version = version
+		self.enemies = frozen(enemies)
+		self.ammo_pickups = frozen(ammo_pickups)
+		self.health_pickups = frozen(health_pickups)
+		self.snitch = snitch
+
+	def replace(self, **changes):
+		fields = {name: getattr(self, name) for name in self.__slots__}
+		fields.update(changes)
+		fields['version'] = self.version + 1
+		return WorldView(**fields)